@@ -0,0 +1,138 @@
+from __future__ import annotations
+from typing import Dict, Optional, Any
+import math
+import os
+import threading
+import time
+
+# Что отвечаем, когда генерация не принимается: (HTTP-статус, сообщение Космокота)
+_REJECT_MESSAGES = {
+    "per_user": (429, "Мяу! Я ещё отвечаю на твоё прошлое сообщение — дай мне договорить 🐾"),
+    "queue_full": (503, "Мяу! Сейчас ко мне очередь до самой Луны 🌙 Попробуй чуть позже!"),
+    "queue_timeout": (503, "Мяу... Не успел дождаться своей очереди на орбите 🛰️ Попробуй ещё раз!"),
+}
+
+
+class AdmissionRejected(Exception):
+    """Запрос на генерацию не принят: reason — per_user / queue_full / queue_timeout."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        self.reason = reason
+        self.status, self.message = _REJECT_MESSAGES[reason]
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class AdmissionController:
+    """
+    Контроль допуска к генерации ответов.
+
+    Одновременно генерируется не больше max_concurrent ответов, ещё не больше
+    max_queue ждут своей очереди (не дольше queue_timeout секунд), у одного
+    пользователя — не больше per_user запросов в работе и в очереди вместе.
+    Всё сверх этого сразу отклоняется с подсказкой Retry-After, а не копится.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, per_user: int = 2,
+                 queue_timeout: float = 10.0) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.per_user = max(1, per_user)
+        self.queue_timeout = max(0.0, queue_timeout)
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        self._per_user: Dict[Any, int] = {}
+        self._admitted = 0
+        self._rejected: Dict[str, int] = {reason: 0 for reason in _REJECT_MESSAGES}
+        self._avg_service_seconds: Optional[float] = None
+
+    def _retry_after(self) -> int:
+        """Оценка, через сколько секунд освободится место: среднее время генерации × длина очереди."""
+        service = self._avg_service_seconds or 5.0
+        return max(1, math.ceil(service * (self._queued + 1) / self.max_concurrent))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self._rejected[reason] += 1
+        return AdmissionRejected(reason, self._retry_after())
+
+    def acquire(self, user_id: Any) -> float:
+        """Ждёт место для генерации или бросает AdmissionRejected. Возвращает момент начала работы."""
+        with self._cond:
+            if self._per_user.get(user_id, 0) >= self.per_user:
+                raise self._reject("per_user")
+            if self._running >= self.max_concurrent and self._queued >= self.max_queue:
+                raise self._reject("queue_full")
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            if self._running >= self.max_concurrent:
+                self._queued += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self._running < self.max_concurrent, self.queue_timeout)
+                finally:
+                    self._queued -= 1
+                if not admitted:
+                    self._release_user(user_id)
+                    raise self._reject("queue_timeout")
+            self._running += 1
+            self._admitted += 1
+            return time.monotonic()
+
+    def _release_user(self, user_id: Any) -> None:
+        left = self._per_user.get(user_id, 0) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
+
+    def release(self, user_id: Any, started_at: float) -> None:
+        with self._cond:
+            self._running -= 1
+            self._release_user(user_id)
+            elapsed = time.monotonic() - started_at
+            # Скользящее среднее времени генерации — для Retry-After
+            if self._avg_service_seconds is None:
+                self._avg_service_seconds = elapsed
+            else:
+                self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * elapsed
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "users_in_flight": len(self._per_user),
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "per_user": self.per_user,
+                "queue_timeout_s": self.queue_timeout,
+                "avg_service_ms": round(self._avg_service_seconds * 1000, 1) if self._avg_service_seconds else None,
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    """
+    Общий контроллер процесса. Лимиты: AI_MAX_CONCURRENT, AI_MAX_QUEUE,
+    AI_MAX_PER_USER и AI_QUEUE_TIMEOUT_S.
+    """
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    max_concurrent=int(os.environ.get("AI_MAX_CONCURRENT", "4")),
+                    max_queue=int(os.environ.get("AI_MAX_QUEUE", "16")),
+                    per_user=int(os.environ.get("AI_MAX_PER_USER", "2")),
+                    queue_timeout=float(os.environ.get("AI_QUEUE_TIMEOUT_S", "10")),
+                )
+    return _controller
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return get_controller().stats()
@@ -1,29 +1,65 @@
 """AI core: CPU-only small Russian-capable model with graceful fallback."""
 
 from __future__ import annotations
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Generator, Tuple, Any, Callable
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+import copy
 import os
-import requests
+import queue
 import threading
 import random
 import re
+import time
 
-# Опциональный импорт трансформеров с обработкой ошибок
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM
-    TRANSFORMERS_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️ Transformers not available: {e}")
-    TRANSFORMERS_AVAILABLE = False
-    torch = None
-    AutoTokenizer = None
-    AutoModelForCausalLM = None
+import metrics
+
+# torch и transformers импортируются лениво, при первой загрузке модели (_import_backend):
+# их импорт занимает секунды, а веб-процессу, CLI и запасным ответам они не нужны.
+torch = None
+AutoTokenizer = None
+AutoModelForCausalLM = None
+StoppingCriteriaList = None
+TextIteratorStreamer = None
+TRANSFORMERS_AVAILABLE: Optional[bool] = None  # None — импорт ещё не пробовали
 
 _lock = threading.Lock()
 _tokenizer: Optional[AutoTokenizer] = None
 _model: Optional[AutoModelForCausalLM] = None
 _model_loaded = False
+_precision = "fp32"
+
+# Режимы точности инференса на CPU (переменная окружения AI_PRECISION)
+PRECISION_MODES = ("fp32", "bf16", "int8")
+
+# Метрики генерации для /metrics (kind — "reply" или "title")
+_TOKEN_BUCKETS = (1, 2, 5, 10, 20, 40, 60, 80, 120, 160, 256, 512)
+_RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+MODEL_LOAD_SECONDS = metrics.gauge("cosmocats_model_load_seconds", "Время загрузки модели, с")
+MODEL_LOADED = metrics.gauge("cosmocats_model_loaded", "Модель загружена (1) или нет (0)")
+TORCH_THREADS = metrics.gauge("cosmocats_torch_threads", "Размер пулов потоков torch", ["pool"])
+TOKENIZE_SECONDS = metrics.histogram("cosmocats_tokenize_seconds", "Токенизация промптов, с", ["kind"])
+GENERATE_SECONDS = metrics.histogram("cosmocats_generate_seconds", "Вызов _model.generate, с", ["kind"])
+DECODE_SECONDS = metrics.histogram("cosmocats_decode_seconds", "Декодирование сгенерированных токенов, с", ["kind"])
+CLEAN_SECONDS = metrics.histogram("cosmocats_clean_seconds", "Очистка ответа (_clean_reply_text), с",
+                                  buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+TIME_TO_FIRST_TOKEN_SECONDS = metrics.histogram("cosmocats_time_to_first_token_seconds",
+                                                "Время до первого сгенерированного токена, с", ["kind"])
+PROMPT_TOKENS = metrics.histogram("cosmocats_prompt_tokens", "Токенов в промпте", ["kind"], _TOKEN_BUCKETS)
+GENERATED_TOKENS = metrics.histogram("cosmocats_generated_tokens", "Сгенерировано токенов", ["kind"], _TOKEN_BUCKETS)
+TOKENS_PER_SECOND = metrics.histogram("cosmocats_tokens_per_second", "Скорость генерации, токенов/с", ["kind"],
+                                      _RATE_BUCKETS)
+GENERATIONS = metrics.counter("cosmocats_generations_total", "Сгенерированных последовательностей", ["kind"])
+DEADLINE_HITS = metrics.counter("cosmocats_deadline_hits_total", "Генераций, остановленных по бюджету времени",
+                                ["kind"])
+FALLBACKS = metrics.counter("cosmocats_fallback_total", "Ответов-заглушек вместо модели", ["kind", "reason"])
+ERRORS = metrics.counter("cosmocats_generation_errors_total", "Исключений при генерации", ["kind"])
+PROFILED = metrics.counter("cosmocats_profiled_generations_total", "Генераций, записанных профилировщиком torch",
+                           ["kind"])
+
+
+def _fallback(kind: str, reason: str) -> None:
+    FALLBACKS.inc(kind=kind, reason=reason)
 
 
 def _ensure_model_cache() -> str:
@@ -64,25 +100,260 @@ def _find_model_in_cache(model_dir: str) -> Optional[str]:
     return snapshot_path
 
 
+def _bf16_supported() -> bool:
+    """Есть ли у CPU аппаратная поддержка bfloat16 (AVX512-BF16/AMX) в oneDNN."""
+    try:
+        return bool(torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def _resolve_precision() -> str:
+    """Режим точности из AI_PRECISION; bf16 без поддержки CPU откатывается на fp32."""
+    precision = os.environ.get("AI_PRECISION", "fp32").strip().lower()
+    if precision not in PRECISION_MODES:
+        print(f"⚠️ Неизвестный AI_PRECISION={precision!r}, используется fp32")
+        return "fp32"
+    if precision == "bf16" and not _bf16_supported():
+        print("⚠️ CPU не поддерживает bfloat16 — используется fp32")
+        return "fp32"
+    return precision
+
+
+def _conv1d_to_linear(module) -> None:
+    """
+    GPT-2 хранит проекции в transformers Conv1D (вес [in, out]), которые
+    динамическая квантизация не видит. Заменяем их эквивалентными nn.Linear.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, bias=child.bias is not None)
+            linear.weight.data = child.weight.data.t().contiguous()
+            if child.bias is not None:
+                linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def _quantize_int8(model):
+    """
+    Динамическая int8-квантизация Linear-слоёв трансформера. lm_head не трогаем:
+    он связан с матрицей эмбеддингов, и его квантованная копия только добавила бы памяти.
+    """
+    backbone = getattr(model, model.base_model_prefix)
+    _conv1d_to_linear(backbone)
+    # inplace: копия backbone разорвала бы связь lm_head с эмбеддингами
+    torch.ao.quantization.quantize_dynamic(backbone, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def _model_footprint_mb(model) -> float:
+    """Объём весов модели в памяти (общие тензоры считаются один раз)."""
+    seen = set()
+
+    def _size(value) -> int:
+        if isinstance(value, (tuple, list)):
+            return sum(_size(v) for v in value)
+        if not isinstance(value, torch.Tensor):
+            return 0
+        key = (value.data_ptr(), value.numel())
+        if key in seen:
+            return 0
+        seen.add(key)
+        return value.numel() * value.element_size()
+
+    return sum(_size(v) for v in model.state_dict().values()) / (1024 * 1024)
+
+
+# Топология потоков torch, применённая при импорте бэкенда (_configure_threads)
+_thread_topology: Dict[str, Any] = {}
+_cpu_slot_file = None  # держим открытым: flock на слот CPU живёт, пока жив процесс
+
+
+def _available_cpus() -> List[int]:
+    """Ядра, на которых процессу разрешено работать (учитывает cpuset контейнера)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _get_process_count() -> int:
+    """
+    Сколько процессов с моделью делят машину: рабочие сервера инференса
+    (AI_INFERENCE_WORKERS, выставляет inference_server) или воркеры
+    gunicorn (WEB_CONCURRENCY).
+    """
+    if os.environ.get("AI_WORKER_INDEX") is not None:
+        return max(1, int(os.environ.get("AI_INFERENCE_WORKERS", "1")))
+    return max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+
+def _parse_cpu_list(value: str) -> List[int]:
+    """Список ядер в формате taskset: "0-3,8,10-11"."""
+    cpus: List[int] = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _claim_cpu_slot(processes: int) -> Optional[int]:
+    """
+    Номер слота процесса среди processes соседей. У рабочих сервера
+    инференса он задан (AI_WORKER_INDEX); воркеры gunicorn занимают первый
+    свободный слот через flock — блокировка снимается сама, когда процесс умирает.
+    """
+    global _cpu_slot_file
+    index = os.environ.get("AI_WORKER_INDEX")
+    if index is not None:
+        return int(index) % processes
+    import fcntl
+    import tempfile
+
+    for slot in range(processes):
+        path = os.path.join(tempfile.gettempdir(), f"cosmocats-cpu-slot-{slot}.lock")
+        f = open(path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _cpu_slot_file = f
+        return slot
+    return None
+
+
+def _configure_threads() -> None:
+    """
+    Пулы потоков torch под число процессов на машине. По умолчанию ядра
+    делятся поровну: intra-op = ядра / процессы (AI_TORCH_THREADS), inter-op = 1
+    (AI_TORCH_INTEROP_THREADS) — generate выполняет операции по очереди.
+    AI_CPU_AFFINITY=auto закрепляет процесс за своей долей ядер, список
+    вида "0-3" — за указанными ядрами; по умолчанию привязки нет.
+    Вызывается сразу после импорта torch, пока пулы ещё не созданы.
+    """
+    cpus = _available_cpus()
+    processes = _get_process_count()
+    intra = int(os.environ.get("AI_TORCH_THREADS", "0")) or max(1, len(cpus) // processes)
+    inter = int(os.environ.get("AI_TORCH_INTEROP_THREADS", "0")) or 1
+
+    affinity = os.environ.get("AI_CPU_AFFINITY", "").strip().lower()
+    pinned: Optional[List[int]] = None
+    if affinity and affinity not in ("0", "off", "none") and hasattr(os, "sched_setaffinity"):
+        try:
+            if affinity == "auto":
+                slot = _claim_cpu_slot(processes)
+                if slot is None:
+                    print("⚠️ Свободного слота CPU не нашлось — процесс не закреплён за ядрами")
+                else:
+                    share = max(1, len(cpus) // processes)
+                    pinned = [cpus[(slot * share + i) % len(cpus)] for i in range(share)]
+            else:
+                pinned = _parse_cpu_list(affinity)
+            if pinned:
+                os.sched_setaffinity(0, pinned)
+                pinned = sorted(os.sched_getaffinity(0))
+                # Потоков больше, чем закреплённых ядер, держать незачем
+                intra = min(intra, len(pinned))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось закрепить процесс за ядрами ({affinity}): {e}")
+            pinned = None
+
+    torch.set_num_threads(intra)
+    try:
+        torch.set_num_interop_threads(inter)
+    except RuntimeError as e:
+        # Пул inter-op уже создан (torch использовали до нас) — его размер не меняется
+        print(f"⚠️ Не удалось задать число inter-op потоков: {e}")
+
+    _thread_topology.update(
+        processes=processes,
+        cpus=len(cpus),
+        intra_op=torch.get_num_threads(),
+        inter_op=torch.get_num_interop_threads(),
+        affinity=pinned,
+    )
+    TORCH_THREADS.set(_thread_topology["intra_op"], pool="intra_op")
+    TORCH_THREADS.set(_thread_topology["inter_op"], pool="inter_op")
+
+
+def _format_thread_topology() -> str:
+    t = _thread_topology
+    pinned = t.get("affinity")
+    affinity = f"ядра {','.join(map(str, pinned))}" if pinned else "без привязки к ядрам"
+    return (f"intra-op {t.get('intra_op')}, inter-op {t.get('inter_op')} "
+            f"(процессов с моделью: {t.get('processes')}, доступно ядер: {t.get('cpus')}, {affinity})")
+
+
+def _import_backend() -> bool:
+    """Импортирует torch и transformers (один раз). Возвращает False, если их нет."""
+    global torch, AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList, TextIteratorStreamer
+    global TRANSFORMERS_AVAILABLE
+    if TRANSFORMERS_AVAILABLE is not None:
+        return TRANSFORMERS_AVAILABLE
+    with _lock:
+        if TRANSFORMERS_AVAILABLE is not None:
+            return TRANSFORMERS_AVAILABLE
+        try:
+            import torch as _torch
+            from transformers import (
+                AutoTokenizer as _AutoTokenizer,
+                AutoModelForCausalLM as _AutoModelForCausalLM,
+                StoppingCriteriaList as _StoppingCriteriaList,
+                TextIteratorStreamer as _TextIteratorStreamer,
+            )
+        except ImportError as e:
+            print(f"⚠️ Transformers not available: {e}")
+            TRANSFORMERS_AVAILABLE = False
+            return False
+        torch = _torch
+        try:
+            _configure_threads()
+        except Exception as e:
+            print(f"⚠️ Не удалось настроить потоки torch: {e}")
+        AutoTokenizer = _AutoTokenizer
+        AutoModelForCausalLM = _AutoModelForCausalLM
+        StoppingCriteriaList = _StoppingCriteriaList
+        TextIteratorStreamer = _TextIteratorStreamer
+        TRANSFORMERS_AVAILABLE = True
+        return True
+
+
 def _ensure_loaded() -> bool:
     """Загружает модель. Возвращает True при успехе, False при ошибке."""
-    global _tokenizer, _model, _model_loaded
+    global _tokenizer, _model, _model_loaded, _precision
     
+    if _model_loaded:
+        return True
+
     # Если трансформеры не доступны, сразу выходим
-    if not TRANSFORMERS_AVAILABLE:
+    if not _import_backend():
         print("❌ Transformers not available - using fallback mode")
         return False
-        
-    if _model_loaded:
-        return True
 
     with _lock:
         if _model_loaded:
             return True
 
         model_dir = _ensure_model_cache()
+        load_started = time.perf_counter()
 
         try:
+            precision = _resolve_precision()
+            load_kwargs = dict(
+                dtype=torch.bfloat16 if precision == "bf16" else torch.float32,
+                low_cpu_mem_usage=True
+            )
             local_model_path = _find_model_in_cache(model_dir)
             
             if local_model_path:
@@ -90,8 +361,7 @@ def _ensure_loaded() -> bool:
                 _model = AutoModelForCausalLM.from_pretrained(
                     local_model_path,
                     local_files_only=True,
-                    dtype=torch.float32,
-                    low_cpu_mem_usage=True
+                    **load_kwargs
                 )
             else:
                 model_name = "ai-forever/rugpt3small_based_on_gpt2"
@@ -99,15 +369,29 @@ def _ensure_loaded() -> bool:
                 _model = AutoModelForCausalLM.from_pretrained(
                     model_name,
                     cache_dir=model_dir,
-                    dtype=torch.float32,
-                    low_cpu_mem_usage=True
+                    **load_kwargs
                 )
 
             if _tokenizer.pad_token is None:
                 _tokenizer.pad_token = _tokenizer.eos_token
+            # Для батчей decoder-only модели новые токены должны идти сразу за промптом
+            _tokenizer.padding_side = "left"
             
             _model.eval()
+            if precision == "int8":
+                _model = _quantize_int8(_model)
+            _precision = precision
+            print(f"ℹ️ Точность инференса: {precision}, веса модели: {_model_footprint_mb(_model):.1f} МБ")
+            print(f"ℹ️ Потоки torch: {_format_thread_topology()}")
+            try:
+                _prepare_prefix_caches()
+            except Exception as e:
+                # Без кеша генерация работает, просто медленнее
+                _prefix_caches.clear()
+                print(f"⚠️ Не удалось подготовить KV-кеш системных промптов: {e}")
             _model_loaded = True
+            MODEL_LOAD_SECONDS.set(time.perf_counter() - load_started)
+            MODEL_LOADED.set(1)
             print("✅ AI model loaded successfully")
             return True
 
@@ -116,28 +400,33 @@ def _ensure_loaded() -> bool:
             return False
 
 
-def _build_prompt(messages: List[Dict[str, str]]) -> str:
-    system_prompt = (
-        "Ты — космический котик Космокот! Ты живёшь на космической станции, любишь молоко, коробки, лазить по клавиатуре и смотреть на звёзды. "
-        "Ты очень любознательный, добрый, но немного ленивый. Всегда отвечай от лица Космокота. "
-        "Отвечай КРАТКО - максимум 1-2 предложения! Добавляй 'мяу', 'мур' или кошачьи звуки и космические эмодзи в каждый ответ. "
-        "Будь игривым, забавным и милым, как настоящий котик в космосе! НЕ давай скучные, формальные или длинные ответы. "
-        "Всегда оставайся в роли Космокота, не выходи изキャラクター.\n\n"
-        "Примеры разговоров:\n"
-        "Человек: Привет!\n"
-        "Космокот: Мяу! Привет, землянин! Как твои дела в этом огромном космосе? 😺🚀\n\n"
-        "Человек: Расскажи о себе.\n"
-        "Космокот: Я Космокот, мурлыкаю на станции среди звёзд, обожаю молоко и коробки! Мурр! 🐱🌌\n\n"
-        "Человек: Что ты любишь есть?\n"
-        "Космокот: Молоко из галактики и космическую рыбку! Ням-ням, мяу! 🥛🐟\n\n"
-        "Человек: Как пройти в библиотеку?\n"
-        "Космокот: Ой, я не знаю, но могу полазить по клавиатуре и найти! Мяу, давай поищем вместе? 📚🐾\n\n"
-        "Теперь продолжи разговор от лица Космокота:"
-    )
+# Сколько последних сообщений диалога попадает в промпт ответа
+CONTEXT_MESSAGES = 4
 
+# Неизменная часть промпта ответа; её KV-кеш считается один раз при загрузке модели
+_REPLY_SYSTEM_PROMPT = (
+    "Ты — космический котик Космокот! Ты живёшь на космической станции, любишь молоко, коробки, лазить по клавиатуре и смотреть на звёзды. "
+    "Ты очень любознательный, добрый, но немного ленивый. Всегда отвечай от лица Космокота. "
+    "Отвечай КРАТКО - максимум 1-2 предложения! Добавляй 'мяу', 'мур' или кошачьи звуки и космические эмодзи в каждый ответ. "
+    "Будь игривым, забавным и милым, как настоящий котик в космосе! НЕ давай скучные, формальные или длинные ответы. "
+    "Всегда оставайся в роли Космокота, не выходи изキャラクター.\n\n"
+    "Примеры разговоров:\n"
+    "Человек: Привет!\n"
+    "Космокот: Мяу! Привет, землянин! Как твои дела в этом огромном космосе? 😺🚀\n\n"
+    "Человек: Расскажи о себе.\n"
+    "Космокот: Я Космокот, мурлыкаю на станции среди звёзд, обожаю молоко и коробки! Мурр! 🐱🌌\n\n"
+    "Человек: Что ты любишь есть?\n"
+    "Космокот: Молоко из галактики и космическую рыбку! Ням-ням, мяу! 🥛🐟\n\n"
+    "Человек: Как пройти в библиотеку?\n"
+    "Космокот: Ой, я не знаю, но могу полазить по клавиатуре и найти! Мяу, давай поищем вместе? 📚🐾\n\n"
+    "Теперь продолжи разговор от лица Космокота:"
+)
+
+
+def _build_prompt(messages: List[Dict[str, str]]) -> str:
     conversation = []
-    # Берем только последние 4 сообщения для контекста
-    valid_messages = messages[-4:]
+    # Берем только последние сообщения для контекста
+    valid_messages = messages[-CONTEXT_MESSAGES:]
     
     for msg in valid_messages:
         role = msg.get("role", "").strip()
@@ -153,29 +442,77 @@ def _build_prompt(messages: List[Dict[str, str]]) -> str:
     if not valid_messages:
         conversation.append("Человек: Привет!")
 
-    prompt = system_prompt + "\n" + "\n".join(conversation) + "\nКосмокот:"
+    prompt = _REPLY_SYSTEM_PROMPT + "\n" + "\n".join(conversation) + "\nКосмокот:"
     return prompt
 
+
+# Всё после этих фраз — модель начала писать реплику за собеседника
+_STOP_PHRASES = [
+    "Человек:", "Пользователь:", "User:", "Assistant:",
+    "System:", "\nЧеловек", "\nПользователь", "Космокот:"
+]
+_MAX_REPLY_SENTENCES = 2
+_MAX_REPLY_CHARS = 120
+_MAX_TITLE_CHARS = 50
+
+_FALLBACK_REPLIES = [
+    "Мяу! Космокот на связи! 🐱🚀",
+    "Привет! Я тут, в космосе! ✨",
+    "Мур-мур! Рад тебя видеть! 😺",
+    "Космокот в эфире! 🛰️"
+]
+_ERROR_REPLY = "Мяу! Что-то пошло не так... Попробуй ещё раз! 😺"
+
+# Параметры сэмплирования ответа — общие для обычной и потоковой генерации
+_REPLY_GENERATION_KWARGS: Dict[str, Any] = dict(
+    max_new_tokens=60,
+    temperature=0.6,  # Понизили для большей coherentности
+    do_sample=True,
+    repetition_penalty=1.2,  # Увеличили чтобы избежать повторений
+    no_repeat_ngram_size=4,  # Увеличили
+    top_p=0.8,  # Понизили для фокуса
+    top_k=20,  # Понизили
+)
+
+# Параметры сэмплирования названия чата
+_TITLE_GENERATION_KWARGS: Dict[str, Any] = dict(
+    max_new_tokens=30,  # Увеличили для лучших названий
+    temperature=0.7,
+    do_sample=True,
+    repetition_penalty=1.2,
+    no_repeat_ngram_size=2,
+    top_p=0.9,
+    top_k=40,
+)
+
+_GENERATION_KWARGS: Dict[str, Dict[str, Any]] = {
+    "reply": _REPLY_GENERATION_KWARGS,
+    "title": _TITLE_GENERATION_KWARGS,
+}
+
+
 def _truncate_to_sentences(text: str, max_sentences: int) -> str:
     """Обрезает текст до указанного количества предложений."""
     sentences = re.split(r'[.!?]+', text)
     sentences = [s.strip() for s in sentences if s.strip()]
     return '. '.join(sentences[:max_sentences]) + ('.' if sentences else '')
 
-def _clean_reply(reply: str) -> str:
-    """Тщательная очистка ответа от бессвязного текста."""
+
+def _is_noise_word(word: str) -> bool:
+    """Слова, которые выглядят как случайный шум модели."""
+    return len(word) > 20 or word.count('.') > 3
+
+
+def _clean_reply_text(reply: str) -> Optional[str]:
+    """Тщательная очистка ответа от бессвязного текста; None, если осмысленного текста не осталось."""
     if not reply:
-        return "Мяу? Я не понял... Попробуй ещё раз! 😺"
+        return None
     
     # Убираем лишние пробелы
     reply = re.sub(r'\s+', ' ', reply).strip()
     
     # Удаляем всё после стоп-фраз
-    stop_phrases = [
-        "Человек:", "Пользователь:", "User:", "Assistant:", 
-        "System:", "\nЧеловек", "\nПользователь", "Космокот:"
-    ]
-    for stop in stop_phrases:
+    for stop in _STOP_PHRASES:
         idx = reply.find(stop)
         if idx != -1:
             reply = reply[:idx].strip()
@@ -183,20 +520,14 @@ def _clean_reply(reply: str) -> str:
     # Удаляем бессмысленные повторения и случайный текст
     words = reply.split()
     if len(words) > 2:
-        cleaned_words = []
-        for word in words:
-            # Пропускаем слова, которые выглядят как случайный шум
-            if len(word) > 20 or word.count('.') > 3:
-                continue
-            cleaned_words.append(word)
-        reply = ' '.join(cleaned_words)
+        reply = ' '.join(word for word in words if not _is_noise_word(word))
     
     # Обрезаем до 2 предложений максимум
-    reply = _truncate_to_sentences(reply, 2)
+    reply = _truncate_to_sentences(reply, _MAX_REPLY_SENTENCES)
     
     # Дополнительная проверка: если пусто или бессмысленно
     if not reply or len(reply) < 5 or reply.count(' ') < 1 or all(c in '.,!?;:' for c in reply.replace(' ', '')):
-        return "Мяу! Интересный вопрос, но я подумаю! 🐱"
+        return None
     
     # Добавляем кошачий элемент если его нет
     cat_keywords = ['мяу', 'мур', 'mur', 'meow', '🐱', '😺', '🚀', '💫', '🌌']
@@ -205,147 +536,1044 @@ def _clean_reply(reply: str) -> str:
         reply += random.choice(cat_elements)
     
     # Ограничиваем общую длину
-    return reply[:120].strip()
+    return reply[:_MAX_REPLY_CHARS].strip()
 
 
-def generate_reply(messages: List[Dict[str, str]]) -> str:
+def _placeholder_reply(raw_reply: str) -> str:
+    """Фраза вместо ответа, от которого после очистки ничего не осталось."""
+    if not raw_reply:
+        return "Мяу? Я не понял... Попробуй ещё раз! 😺"
+    return "Мяу! Интересный вопрос, но я подумаю! 🐱"
+
+
+def _finalize_reply(raw_reply: str) -> Tuple[str, bool]:
     """
-    Генерирует ответ с улучшенным контролем качества.
+    Очистка сырого ответа модели и финальная проверка качества.
+
+    Возвращает ответ и флаг — это текст модели (True) или заглушка (False).
     """
-    if not _ensure_loaded():
-        fallback_responses = [
-            "Мяу! Космокот на связи! 🐱🚀",
-            "Привет! Я тут, в космосе! ✨",
-            "Мур-мур! Рад тебя видеть! 😺", 
-            "Космокот в эфире! 🛰️"
-        ]
-        return random.choice(fallback_responses)
+    with CLEAN_SECONDS.time():
+        cleaned_reply = _clean_reply_text(raw_reply)
+    if cleaned_reply is None:
+        _fallback("reply", "low_quality")
+        return _placeholder_reply(raw_reply), False
+    return cleaned_reply, True
+
+
+def _deadline_reply(raw_reply: str) -> str:
+    """Ответ, недописанный из-за бюджета времени: очищенный кусок, если он осмысленный, иначе запасная фраза."""
+    with CLEAN_SECONDS.time():
+        cleaned_reply = _clean_reply_text(raw_reply)
+    if cleaned_reply is None:
+        _fallback("reply", "deadline")
+        return random.choice(_FALLBACK_REPLIES)
+    return cleaned_reply
+
+
+def _partial_reply(raw_reply: str) -> Tuple[str, bool]:
+    """
+    Инкрементальная версия _clean_reply_text для ещё не дописанного ответа.
+
+    Возвращает префикс, который уже можно показать пользователю, и флаг —
+    достигнута ли стоп-фраза, лимит предложений или символов (дальше
+    генерировать бессмысленно, _clean_reply_text всё равно это отрежет).
+    """
+    text = re.sub(r'\s+', ' ', raw_reply).lstrip()
+    finished = False
+    for stop in _STOP_PHRASES:
+        idx = text.find(stop)
+        if idx != -1:
+            text = text[:idx]
+            finished = True
+
+    # Последнее слово может ещё дописываться (и оказаться началом стоп-фразы)
+    if not finished:
+        text = text[:text.rfind(' ') + 1]
+
+    # Шумовые слова выбрасываем сразу: к концу генерации слов почти наверняка
+    # будет больше двух, и _clean_reply_text их тоже уберёт
+    text = ' '.join(word for word in text.split() if not _is_noise_word(word))
+
+    sentences = 0
+    start = 0
+    for match in re.finditer(r'[.!?]+', text):
+        if text[start:match.start()].strip():
+            sentences += 1
+            if sentences >= _MAX_REPLY_SENTENCES:
+                text = text[:match.end()]
+                finished = True
+                break
+        start = match.end()
+
+    # _truncate_to_sentences схлопывает знаки препинания, поэтому бюджет
+    # символов меряем по уже нормализованному тексту
+    if len(_truncate_to_sentences(text, _MAX_REPLY_SENTENCES)) >= _MAX_REPLY_CHARS:
+        finished = True
+    return text[:_MAX_REPLY_CHARS], finished
+
+
+def _reply_is_complete(raw_reply: str) -> bool:
+    """Дальнейшие токены ответа гарантированно отрежет _clean_reply_text."""
+    return _partial_reply(raw_reply)[1]
+
+
+def _title_is_complete(raw_title: str) -> bool:
+    """Название уже закончилось: есть конец предложения/строки или набран лимит длины."""
+    text = raw_title.lstrip()
+    return re.search(r'[.!?\n]', text) is not None or len(text.strip()) > _MAX_TITLE_CHARS
+
+
+class _TextStoppingCriteria:
+    """
+    Останавливает каждую последовательность пачки, как только её уже
+    сгенерированный текст станет окончательным после очистки (стоп-фраза,
+    лимит предложений или символов) — дальше модель работала бы впустую.
+
+    Текст строки и так декодируется на каждом шаге, поэтому заодно отдаётся
+    слушателям on_text[i] — так потоковые ответы получают токены из общей пачки.
+
+    Критерии — просто вызываемые объекты для StoppingCriteriaList: наследоваться
+    от transformers.StoppingCriteria значило бы импортировать transformers заранее.
+    """
+
+    def __init__(self, prompt_length: int, is_complete: Callable[[str], bool],
+                 on_text: Optional[List[Optional[Callable[[str], None]]]] = None) -> None:
+        self.prompt_length = prompt_length
+        self.is_complete = is_complete
+        self.on_text = on_text
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for i, row in enumerate(input_ids):
+            text = _tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True)
+            if self.on_text is not None and self.on_text[i] is not None:
+                self.on_text[i](text)
+            done.append(self.is_complete(text))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+_COMPLETION_CHECKS: Dict[str, Callable[[str], bool]] = {
+    "reply": _reply_is_complete,
+    "title": _title_is_complete,
+}
+
+
+class _CancelCriteria:
+    """Останавливает строки пачки, чей потребитель потока больше не ждёт токенов (None — строка не потоковая)."""
+
+    def __init__(self, cancelled: List[Optional[threading.Event]]) -> None:
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        flags = [event is not None and event.is_set() for event in self.cancelled]
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+class _DeadlineCriteria:
+    """
+    Останавливает строки пачки, у которых истёк бюджет времени (момент по time.monotonic).
+    expired[i] — строка i остановлена по времени, а не закончилась сама: у
+    закончившейся строки последний токен уже pad, такую не отмечаем.
+    """
+
+    def __init__(self, deadlines: List[float], pad_token_id: Optional[int]) -> None:
+        self.deadlines = deadlines
+        self.pad_token_id = pad_token_id
+        self.expired = [False] * len(deadlines)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.monotonic()
+        for i, deadline in enumerate(self.deadlines):
+            if not self.expired[i] and now >= deadline and int(input_ids[i, -1]) != self.pad_token_id:
+                self.expired[i] = True
+        return torch.tensor(self.expired, dtype=torch.bool, device=input_ids.device)
+
+
+class _FirstTokenTimer:
+    """Критерий-наблюдатель: generate впервые вызывает критерии сразу после первого токена — это и есть TTFT."""
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.seen = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.seen:
+            self.seen = True
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - self.started, kind=self.kind)
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+
+def _observe_prompt_tokens(kind: str, input_ids, attention_mask) -> None:
+    lengths = attention_mask.sum(dim=1).tolist() if attention_mask is not None else [input_ids.shape[1]] * input_ids.shape[0]
+    for length in lengths:
+        PROMPT_TOKENS.observe(length, kind=kind)
+
+
+def _observe_generated_tokens(kind: str, outputs, prompt_length: int, elapsed: float) -> None:
+    """Новые токены каждой строки (без pad после окончания) и общая скорость пачки."""
+    total = 0
+    for row in outputs:
+        generated = int((row[prompt_length:] != _tokenizer.pad_token_id).sum())
+        GENERATED_TOKENS.observe(generated, kind=kind)
+        total += generated
+    if elapsed > 0:
+        TOKENS_PER_SECOND.observe(total / elapsed, kind=kind)
+
+
+_profile_counter = 0
+_profile_lock = threading.Lock()
+
+
+def _get_profile_every() -> int:
+    """AI_PROFILE_EVERY_N: профилировать каждую N-ю генерацию (0 — выключено)."""
+    return int(os.environ.get("AI_PROFILE_EVERY_N", "0"))
+
+
+class _NoProfile:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+class _TorchProfile:
+    """torch.profiler вокруг одной генерации; трейс (chrome://tracing) пишется в AI_PROFILE_DIR."""
+
+    def __init__(self, kind: str, number: int) -> None:
+        self.kind = kind
+        self.number = number
+        self.profiler = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+        )
+
+    def __enter__(self):
+        self.profiler.__enter__()
+        return self.profiler
+
+    def __exit__(self, *exc) -> bool:
+        self.profiler.__exit__(*exc)
+        try:
+            profile_dir = os.path.abspath(os.environ.get("AI_PROFILE_DIR", "profiles"))
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f"{self.kind}-{int(time.time())}-{os.getpid()}-{self.number}.json")
+            self.profiler.export_chrome_trace(path)
+            PROFILED.inc(kind=self.kind)
+            print(f"ℹ️ Профиль генерации записан: {path}")
+        except Exception as e:
+            print(f"⚠️ Не удалось записать профиль генерации: {e}")
+        return False
+
+
+def _maybe_profile(kind: str):
+    """Каждая AI_PROFILE_EVERY_N-я генерация идёт под профилировщиком torch, остальные — как есть."""
+    global _profile_counter
+    every = _get_profile_every()
+    if every <= 0:
+        return _NoProfile()
+    with _profile_lock:
+        _profile_counter += 1
+        number = _profile_counter
+    if number % every:
+        return _NoProfile()
+    return _TorchProfile(kind, number)
+
+
+def _get_deadline_seconds(kind: str) -> float:
+    """Бюджет времени на генерацию: AI_REPLY_DEADLINE_S / AI_TITLE_DEADLINE_S (0 — без ограничения)."""
+    if kind == "title":
+        return float(os.environ.get("AI_TITLE_DEADLINE_S", "10"))
+    return float(os.environ.get("AI_REPLY_DEADLINE_S", "20"))
+
+
+def _deadline_for(kind: str, started_at: Optional[float] = None) -> float:
+    budget = _get_deadline_seconds(kind)
+    if budget <= 0:
+        return float("inf")
+    return (started_at if started_at is not None else time.monotonic()) + budget
+
+
+_deadline_hits: Dict[str, int] = {"reply": 0, "title": 0}
+_generations: Dict[str, int] = {"reply": 0, "title": 0}
+_generation_stats_lock = threading.Lock()
+
+
+def _record_generations(kind: str, count: int, deadline_hits: int) -> None:
+    with _generation_stats_lock:
+        _generations[kind] = _generations.get(kind, 0) + count
+        _deadline_hits[kind] = _deadline_hits.get(kind, 0) + deadline_hits
+    GENERATIONS.inc(count, kind=kind)
+    if deadline_hits:
+        DEADLINE_HITS.inc(deadline_hits, kind=kind)
+
+
+def get_generation_stats() -> Dict[str, Any]:
+    """Сколько генераций было и сколько из них упёрлось в бюджет времени."""
+    with _generation_stats_lock:
+        return {
+            "generations": dict(_generations),
+            "deadline_hits": dict(_deadline_hits),
+            "deadline_s": {kind: _get_deadline_seconds(kind) for kind in ("reply", "title")},
+        }
+
+
+class _PrefixCache:
+    """Токены и past_key_values неизменного начала промпта."""
+
+    __slots__ = ("text", "ids", "past_key_values")
+
+    def __init__(self, text: str, ids: List[int], past_key_values: Any) -> None:
+        self.text = text
+        self.ids = ids
+        self.past_key_values = past_key_values
+
+
+_prefix_caches: Dict[str, _PrefixCache] = {}
+
+# Бюджет токенов на изменяемую часть промпта (диалог) поверх закешированного префикса
+_TAIL_MAX_TOKENS = 256
 
-    try:
-        assert _tokenizer is not None and _model is not None
-        
-        prompt = _build_prompt(messages)
 
+def _prepare_prefix_caches() -> None:
+    """
+    Один раз прогоняет через модель системные промпты ответа и названия и
+    запоминает их KV-кеш. Префикс обрезается по последнему непробельному
+    символу: хвост всегда начинается с пробела/перевода строки, поэтому
+    токенизация префикса и хвоста по отдельности совпадает с токенизацией
+    целого промпта.
+    """
+    device = next(_model.parameters()).device
+    for kind, system_prompt in (("reply", _REPLY_SYSTEM_PROMPT), ("title", _TITLE_SYSTEM_PROMPT)):
+        text = system_prompt.rstrip()
+        ids = _tokenizer(text, add_special_tokens=False).input_ids
+        with torch.no_grad():
+            outputs = _model(torch.tensor([ids], device=device), use_cache=True)
+        _prefix_caches[kind] = _PrefixCache(text, ids, outputs.past_key_values)
+        print(f"✅ KV-кеш системного промпта '{kind}': {len(ids)} токенов")
+
+
+def _encode_batch(kind: str, prompts: List[str]):
+    """
+    Готовит входы _model.generate для пачки промптов одного вида.
+
+    Если все промпты начинаются с закешированного системного префикса, модель
+    получает копию его past_key_values и считает только хвост (диалог), а
+    короткие хвосты выравниваются паддингом между префиксом и хвостом.
+    Иначе промпты токенизируются целиком с паддингом слева.
+    Возвращает (input_ids, attention_mask, past_key_values или None).
+    """
+    device = next(_model.parameters()).device
+    prefix = _prefix_caches.get(kind)
+
+    if prefix is None or not all(p.startswith(prefix.text) for p in prompts):
         inputs = _tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
             max_length=256,
             truncation=True,
-            padding=False
+            padding=True
         )
-
-        device = next(_model.parameters()).device
         input_ids = inputs.input_ids.to(device)
         attention_mask = inputs.attention_mask.to(device) if inputs.attention_mask is not None else None
+        return input_ids, attention_mask, None
 
-        with torch.no_grad():
-            outputs = _model.generate(
-                input_ids,
-                attention_mask=attention_mask,
-                max_new_tokens=60,
-                temperature=0.6,  # Понизили для большей coherentности
-                do_sample=True,
-                pad_token_id=_tokenizer.pad_token_id,
-                eos_token_id=_tokenizer.eos_token_id, 
-                repetition_penalty=1.2,  # Увеличили чтобы избежать повторений
-                no_repeat_ngram_size=4,  # Увеличили
-                top_p=0.8,  # Понизили для фокуса
-                top_k=20,  # Понизили
+    # Хвост обрезаем слева, чтобы сохранить последние реплики диалога
+    tails = [
+        _tokenizer(p[len(prefix.text):], add_special_tokens=False).input_ids[-_TAIL_MAX_TOKENS:]
+        for p in prompts
+    ]
+    width = max(len(tail) for tail in tails)
+    rows, masks = [], []
+    for tail in tails:
+        padding = width - len(tail)
+        rows.append(prefix.ids + [_tokenizer.pad_token_id] * padding + tail)
+        masks.append([1] * len(prefix.ids) + [0] * padding + [1] * len(tail))
+
+    # generate дописывает кеш на месте, поэтому каждому вызову — своя копия
+    past_key_values = copy.deepcopy(prefix.past_key_values)
+    if len(prompts) > 1:
+        past_key_values.batch_repeat_interleave(len(prompts))
+
+    input_ids = torch.tensor(rows, dtype=torch.long, device=device)
+    attention_mask = torch.tensor(masks, dtype=torch.long, device=device)
+    return input_ids, attention_mask, past_key_values
+
+
+def _generate_texts(kind: str, prompts: List[str], deadlines: Optional[List[float]] = None,
+                    on_text: Optional[List[Optional[Callable[[str], None]]]] = None,
+                    cancelled: Optional[List[Optional[threading.Event]]] = None) -> List[Tuple[str, bool]]:
+    """
+    Генерирует продолжения для пачки промптов одного вида ("reply"/"title")
+    одним вызовом _model.generate. Возвращает (текст, истекло ли время) на каждый промпт;
+    deadlines — моменты time.monotonic, после которых строка останавливается (по умолчанию
+    бюджет вида от текущего момента). on_text[i] получает уже сгенерированный текст
+    строки после каждого шага, cancelled[i] останавливает строку досрочно — для потоковых ответов.
+    """
+    if deadlines is None:
+        deadlines = [_deadline_for(kind)] * len(prompts)
+    with TOKENIZE_SECONDS.time(kind=kind):
+        input_ids, attention_mask, past_key_values = _encode_batch(kind, prompts)
+    _observe_prompt_tokens(kind, input_ids, attention_mask)
+    deadline_criteria = _DeadlineCriteria(deadlines, _tokenizer.pad_token_id)
+    first_token = _FirstTokenTimer(kind)
+    criteria = [
+        first_token,
+        _TextStoppingCriteria(input_ids.shape[1], _COMPLETION_CHECKS[kind], on_text),
+        deadline_criteria,
+    ]
+    if cancelled is not None and any(event is not None for event in cancelled):
+        criteria.append(_CancelCriteria(cancelled))
+
+    with torch.no_grad(), _maybe_profile(kind):
+        outputs = _model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            pad_token_id=_tokenizer.pad_token_id,
+            eos_token_id=_tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList(criteria),
+            **_GENERATION_KWARGS[kind],
+        )
+    elapsed = time.perf_counter() - first_token.started
+    GENERATE_SECONDS.observe(elapsed, kind=kind)
+    _record_generations(kind, len(prompts), sum(deadline_criteria.expired))
+
+    # Декодируем только новые токены
+    prompt_length = input_ids.shape[1]
+    _observe_generated_tokens(kind, outputs, prompt_length, elapsed)
+    with DECODE_SECONDS.time(kind=kind):
+        return [
+            (_tokenizer.decode(row[prompt_length:], skip_special_tokens=True).strip(), expired)
+            for row, expired in zip(outputs, deadline_criteria.expired)
+        ]
+
+
+class _PendingRequest:
+    """Промпт, ожидающий своей очереди в планировщике."""
+
+    __slots__ = ("kind", "prompt", "on_text", "cancelled", "future", "enqueued_at", "deadline")
+
+    def __init__(self, kind: str, prompt: str, on_text: Optional[Callable[[str], None]] = None,
+                 cancelled: Optional[threading.Event] = None) -> None:
+        self.kind = kind
+        self.prompt = prompt
+        self.on_text = on_text
+        self.cancelled = cancelled
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        # Время ожидания в очереди тоже входит в бюджет
+        self.deadline = _deadline_for(kind, self.enqueued_at)
+
+
+class InferenceScheduler:
+    """
+    Планировщик инференса с динамическим батчингом.
+
+    Потоки Flask кладут промпты в общую очередь и ждут результат через Future,
+    а единственный поток инференса набирает из очереди пачку (не больше
+    max_batch_size промптов, ожидая добора не дольше max_wait секунд) и
+    генерирует её одним вызовом _model.generate.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait: float = 0.02) -> None:
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
+        self._latencies: deque = deque(maxlen=1000)
+
+    def submit(self, kind: str, prompt: str, on_text: Optional[Callable[[str], None]] = None,
+               cancelled: Optional[threading.Event] = None) -> Future:
+        """
+        Ставит промпт в очередь; результат — (сырой сгенерированный текст, истёк ли бюджет времени).
+        on_text и cancelled — для потоковых ответов (см. _generate_texts).
+        """
+        self._ensure_started()
+        request = _PendingRequest(kind, prompt, on_text, cancelled)
+        self._queue.put(request)
+        return request.future
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self) -> List[_PendingRequest]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = []
+            for request in self._collect_batch():
+                # Потоковый ответ, который перестали читать ещё в очереди, не генерируем
+                if request.cancelled is not None and request.cancelled.is_set():
+                    request.future.cancel()
+                if request.future.set_running_or_notify_cancel():
+                    batch.append(request)
+            by_kind: Dict[str, List[_PendingRequest]] = {}
+            for request in batch:
+                by_kind.setdefault(request.kind, []).append(request)
+            for kind, requests_of_kind in by_kind.items():
+                self._run_batch(kind, requests_of_kind)
+
+    def _run_batch(self, kind: str, batch: List[_PendingRequest]) -> None:
+        # Запросы, чьё время истекло ещё в очереди, не генерируем вовсе
+        now = time.monotonic()
+        expired = [r for r in batch if r.deadline <= now]
+        if expired:
+            _record_generations(kind, len(expired), len(expired))
+            for request in expired:
+                request.future.set_result(("", True))
+            batch = [r for r in batch if r.deadline > now]
+            if not batch:
+                return
+        try:
+            texts = _generate_texts(
+                kind, [r.prompt for r in batch], [r.deadline for r in batch],
+                [r.on_text for r in batch], [r.cancelled for r in batch],
             )
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+        else:
+            for request, text in zip(batch, texts):
+                request.future.set_result(text)
 
-        # Декодируем только новые токены
-        new_tokens = outputs[0][input_ids.shape[1]:]
-        reply = _tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        finished_at = time.monotonic()
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._last_batch_size = len(batch)
+            self._max_batch_size_seen = max(self._max_batch_size_seen, len(batch))
+            self._latencies.extend(finished_at - r.enqueued_at for r in batch)
 
-        # Тщательная очистка
-        cleaned_reply = _clean_reply(reply)
-        
-        # Дополнительная проверка качества
-        if len(cleaned_reply) < 5 or cleaned_reply.count(' ') < 1:
-            return "Мяу! Не могу придумать хороший ответ... Спроси по-другому! 😿"
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, размеры пачек и задержка запросов (по последним 1000)."""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            batches = self._batches
+            result: Dict[str, Any] = {
+                "enabled": True,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "queue_depth": self._queue.qsize(),
+                "batches": batches,
+                "requests": self._requests,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size_seen": self._max_batch_size_seen,
+                "avg_batch_size": round(self._requests / batches, 2) if batches else 0.0,
+            }
+        if latencies:
+            result["latency_ms"] = {
+                "avg": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+            }
+        return result
+
+
+_scheduler: Optional[InferenceScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def _get_scheduler() -> Optional[InferenceScheduler]:
+    """
+    Возвращает общий планировщик, если батчинг включён (AI_BATCHING=1).
+    Размер пачки и время ожидания задаются AI_BATCH_MAX_SIZE и AI_BATCH_MAX_WAIT_MS.
+    """
+    global _scheduler
+    if os.environ.get("AI_BATCHING", "0") != "1":
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = InferenceScheduler(
+                    max_batch_size=int(os.environ.get("AI_BATCH_MAX_SIZE", "8")),
+                    max_wait=float(os.environ.get("AI_BATCH_MAX_WAIT_MS", "20")) / 1000,
+                )
+    return _scheduler
+
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    """Статистика планировщика инференса для мониторинга."""
+    scheduler = _get_scheduler()
+    if scheduler is None:
+        return {"enabled": False}
+    return scheduler.stats()
+
+
+def _complete(kind: str, prompt: str) -> Tuple[str, bool]:
+    """
+    Генерирует продолжение промпта — через планировщик, если батчинг включён.
+    Возвращает (сырой текст, истёк ли бюджет времени).
+    """
+    scheduler = _get_scheduler()
+    if scheduler is None:
+        return _generate_texts(kind, [prompt])[0]
+    return scheduler.submit(kind, prompt).result()
+
+
+class _ReplyCacheEntry:
+    __slots__ = ("replies", "created_at")
+
+    def __init__(self) -> None:
+        self.replies: List[str] = []
+        self.created_at = time.monotonic()
+
+
+class ReplyCache:
+    """
+    Кеш ответов на частые короткие реплики ("Привет", "Как дела?").
+
+    Ключ — нормализованный контекст из тех же последних CONTEXT_MESSAGES
+    сообщений, что попадают в промпт. На ключ накапливается до variants
+    разных сгенерированных ответов: пока их меньше, запрос считается промахом
+    и идёт в модель, а потом отвечаем случайным из набора — разнообразие
+    сохраняется. Ключей не больше max_keys (вытесняются по LRU), набор живёт
+    ttl секунд. Длинные диалоги (контекст длиннее max_chars) не кешируются.
+    """
+
+    def __init__(self, max_keys: int = 1024, variants: int = 4, ttl: float = 3600.0, max_chars: int = 200) -> None:
+        self.max_keys = max(1, max_keys)
+        self.variants = max(1, variants)
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[Tuple[Tuple[str, str], ...], _ReplyCacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        text = text.lower().replace("ё", "е")
+        text = re.sub(r"[^\w\s]", " ", text)
+        return " ".join(text.split())
+
+    def key(self, messages: List[Dict[str, str]]) -> Optional[Tuple[Tuple[str, str], ...]]:
+        context = tuple(
+            (msg.get("role", ""), self._normalize(msg.get("content", "")))
+            for msg in messages[-CONTEXT_MESSAGES:]
+            if msg.get("content", "").strip()
+        )
+        if sum(len(content) for _, content in context) > self.max_chars:
+            return None
+        return context
+
+    def get(self, key: Tuple[Tuple[str, str], ...]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry.replies) < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry.replies)
+
+    def put(self, key: Tuple[Tuple[str, str], ...], reply: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _ReplyCacheEntry()
+            self._entries.move_to_end(key)
+            if reply not in entry.replies and len(entry.replies) < self.variants:
+                entry.replies.append(reply)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "keys": len(self._entries),
+                "max_keys": self.max_keys,
+                "variants": self.variants,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+_reply_cache: Optional[ReplyCache] = None
+_reply_cache_lock = threading.Lock()
+
+
+def _get_reply_cache() -> Optional[ReplyCache]:
+    """
+    Кеш ответов, если он включён (AI_REPLY_CACHE=1). Параметры: AI_REPLY_CACHE_SIZE,
+    AI_REPLY_CACHE_VARIANTS, AI_REPLY_CACHE_TTL и AI_REPLY_CACHE_MAX_CHARS.
+    """
+    global _reply_cache
+    if os.environ.get("AI_REPLY_CACHE", "0") != "1":
+        return None
+    if _reply_cache is None:
+        with _reply_cache_lock:
+            if _reply_cache is None:
+                _reply_cache = ReplyCache(
+                    max_keys=int(os.environ.get("AI_REPLY_CACHE_SIZE", "1024")),
+                    variants=int(os.environ.get("AI_REPLY_CACHE_VARIANTS", "4")),
+                    ttl=float(os.environ.get("AI_REPLY_CACHE_TTL", "3600")),
+                    max_chars=int(os.environ.get("AI_REPLY_CACHE_MAX_CHARS", "200")),
+                )
+    return _reply_cache
+
+
+def get_reply_cache_stats() -> Dict[str, Any]:
+    cache = _get_reply_cache()
+    if cache is None:
+        return {"enabled": False}
+    return cache.stats()
+
+
+def _get_inference_socket() -> Optional[str]:
+    """Путь к сокету inference_server.py (AI_INFERENCE_SOCKET); без него модель грузится в этом процессе."""
+    return os.environ.get("AI_INFERENCE_SOCKET") or None
+
+
+def _get_inference_timeout() -> float:
+    return float(os.environ.get("AI_INFERENCE_TIMEOUT", "30"))
+
+
+def _connect_inference_server(path: str, timeout: float):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _remote_call(path: str, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Один запрос к серверу инференса и его ответ; ошибки сервера превращаются в исключения."""
+    import inference_server
+    with _connect_inference_server(path, timeout or _get_inference_timeout()) as sock:
+        inference_server.send_message(sock, request)
+        response = inference_server.recv_message(sock)
+    if response is None:
+        raise ConnectionError("сервер инференса закрыл соединение")
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "ошибка сервера инференса"))
+    return response
+
+
+def generate_reply(messages: List[Dict[str, str]]) -> str:
+    """
+    Генерирует ответ с улучшенным контролем качества — в сервере инференса,
+    если он задан (AI_INFERENCE_SOCKET), иначе в этом процессе.
+    """
+    path = _get_inference_socket()
+    if path is None:
+        return _local_generate_reply(messages)
+    try:
+        return _remote_call(path, {"op": "reply", "messages": messages})["text"]
+    except Exception as e:
+        print(f"⚠️ Сервер инференса недоступен: {e}")
+        _fallback("reply", "inference_server")
+        return random.choice(_FALLBACK_REPLIES)
+
+
+def _local_generate_reply(messages: List[Dict[str, str]]) -> str:
+    cache = _get_reply_cache()
+    cache_key = cache.key(messages) if cache is not None else None
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if not _ensure_loaded():
+        _fallback("reply", "model_unavailable")
+        return random.choice(_FALLBACK_REPLIES)
+
+    try:
+        assert _tokenizer is not None and _model is not None
         
-        return cleaned_reply
+        prompt = _build_prompt(messages)
+        reply, timed_out = _complete("reply", prompt)
+        if timed_out:
+            return _deadline_reply(reply)
+
+        # Тщательная очистка и проверка качества; в кеш — только настоящие ответы модели
+        reply, from_model = _finalize_reply(reply)
+        if cache_key is not None and from_model:
+            cache.put(cache_key, reply)
+        return reply
 
     except Exception as e:
         print(f"❌ Ошибка генерации: {e}")
-        return "Мяу! Что-то пошло не так... Попробуй ещё раз! 😺"
+        ERRORS.inc(kind="reply")
+        _fallback("reply", "error")
+        return _ERROR_REPLY
+
+
+def stream_reply(messages: List[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+    """
+    Потоковая версия generate_reply.
+
+    Отдаёт события {"delta": текст} по мере появления токенов (уже с учётом
+    стоп-фраз и лимита предложений) и последним — {"reply": итоговый ответ},
+    совпадающий с тем, что вернул бы generate_reply.
+    """
+    path = _get_inference_socket()
+    if path is None:
+        yield from _local_stream_reply(messages)
+        return
+    yield from _remote_stream_reply(path, messages)
+
+
+def _remote_stream_reply(path: str, messages: List[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+    """События stream_reply из сервера инференса; таймаут AI_INFERENCE_TIMEOUT — на каждое событие."""
+    import inference_server
+    started = False
+    try:
+        with _connect_inference_server(path, _get_inference_timeout()) as sock:
+            inference_server.send_message(sock, {"op": "stream", "messages": messages})
+            while True:
+                event = inference_server.recv_message(sock)
+                if event is None:
+                    raise ConnectionError("сервер инференса закрыл соединение")
+                if event.get("ok") is False:
+                    raise RuntimeError(event.get("error", "ошибка сервера инференса"))
+                started = True
+                yield event
+                if "reply" in event:
+                    return
+    except Exception as e:
+        print(f"⚠️ Сервер инференса недоступен: {e}")
+        _fallback("reply", "inference_server")
+        if started:
+            yield {"reply": _ERROR_REPLY}
+            return
+        reply = random.choice(_FALLBACK_REPLIES)
+        yield {"delta": reply}
+        yield {"reply": reply}
+
+
+def _local_stream_reply(messages: List[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+    cache = _get_reply_cache()
+    cache_key = cache.key(messages) if cache is not None else None
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            yield {"delta": cached}
+            yield {"reply": cached}
+            return
+
+    if not _ensure_loaded():
+        _fallback("reply", "model_unavailable")
+        reply = random.choice(_FALLBACK_REPLIES)
+        yield {"delta": reply}
+        yield {"reply": reply}
+        return
+
+    cancelled = threading.Event()
+    try:
+        assert _tokenizer is not None and _model is not None
+
+        prompt = _build_prompt(messages)
+        scheduler = _get_scheduler()
+        if scheduler is None:
+            texts = _direct_reply_texts(prompt, cancelled)
+        else:
+            texts = _scheduled_reply_texts(scheduler, prompt, cancelled)
+
+        shown = ""
+        finished = False
+        while True:
+            try:
+                raw = next(texts)
+            except StopIteration as stop:
+                raw, timed_out = stop.value
+                break
+            visible, finished = _partial_reply(raw)
+            if len(visible) > len(shown) and visible.startswith(shown):
+                yield {"delta": visible[len(shown):]}
+                shown = visible
+
+        if timed_out and not finished:
+            yield {"reply": _deadline_reply(raw.strip())}
+            return
+        reply, from_model = _finalize_reply(raw.strip())
+        if cache_key is not None and from_model:
+            cache.put(cache_key, reply)
+        yield {"reply": reply}
+
+    except Exception as e:
+        print(f"❌ Ошибка потоковой генерации: {e}")
+        ERRORS.inc(kind="reply")
+        _fallback("reply", "error")
+        yield {"reply": _ERROR_REPLY}
+    finally:
+        cancelled.set()
+
+
+def _direct_reply_texts(prompt: str, cancelled: threading.Event) -> Generator[str, None, Tuple[str, bool]]:
+    """
+    Потоковая генерация отдельным вызовом _model.generate (без планировщика):
+    отдаёт накопленный сырой текст по мере появления токенов и возвращает
+    (весь текст, истёк ли бюджет времени).
+    """
+    with TOKENIZE_SECONDS.time(kind="reply"):
+        input_ids, attention_mask, past_key_values = _encode_batch("reply", [prompt])
+    _observe_prompt_tokens("reply", input_ids, attention_mask)
+    streamer = TextIteratorStreamer(_tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=120)
+    deadline_criteria = _DeadlineCriteria([_deadline_for("reply")], _tokenizer.pad_token_id)
+    first_token = _FirstTokenTimer("reply")
+    errors: List[Exception] = []
+
+    def _run() -> None:
+        try:
+            with torch.no_grad(), _maybe_profile("reply"):
+                outputs = _model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    pad_token_id=_tokenizer.pad_token_id,
+                    eos_token_id=_tokenizer.eos_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([
+                        first_token,
+                        _CancelCriteria([cancelled]),
+                        _TextStoppingCriteria(input_ids.shape[1], _reply_is_complete),
+                        deadline_criteria,
+                    ]),
+                    **_REPLY_GENERATION_KWARGS,
+                )
+            elapsed = time.perf_counter() - first_token.started
+            GENERATE_SECONDS.observe(elapsed, kind="reply")
+            _observe_generated_tokens("reply", outputs, input_ids.shape[1], elapsed)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    threading.Thread(target=_run, name="reply-stream", daemon=True).start()
+
+    # Генерация сама останавливается на окончательном тексте (_TextStoppingCriteria),
+    # поэтому стример дочитываем до конца
+    raw = ""
+    for chunk in streamer:
+        raw += chunk
+        yield raw
+
+    if errors:
+        raise errors[0]
+    timed_out = deadline_criteria.expired[0]
+    _record_generations("reply", 1, int(timed_out))
+    return raw, timed_out
+
+
+def _scheduled_reply_texts(scheduler: InferenceScheduler, prompt: str,
+                           cancelled: threading.Event) -> Generator[str, None, Tuple[str, bool]]:
+    """
+    То же через планировщик: ответ генерируется в общей пачке с другими
+    запросами, а текст своей строки приходит из критерия остановки после каждого шага.
+    """
+    updates: "queue.Queue[Optional[str]]" = queue.Queue()
+    future = scheduler.submit("reply", prompt, on_text=updates.put, cancelled=cancelled)
+    future.add_done_callback(lambda _: updates.put(None))
+    while True:
+        raw = updates.get(timeout=120)
+        if raw is None:
+            break
+        yield raw
+    return future.result()
+
+
+# Неизменная часть промпта названия чата (примеры), тоже кешируется
+_TITLE_SYSTEM_PROMPT = (
+    "Ты — эксперт по созданию названий чатов для космического кота Космокота. "
+    "Создай креативное, короткое название на основе первого сообщения пользователя. "
+    "Название должно быть забавным, включать кошачьи или космические эмодзи и отражать тему. "
+    "Оставайся в теме Космокота.\n\n"
+    "Примеры:\n"
+    "Сообщение: Привет, как дела?\n"
+    "Название чата: Привет от Космокота! 😺🚀\n\n"
+    "Сообщение: Расскажи о космосе.\n"
+    "Название чата: Космические тайны с котиком 🐱🌌\n\n"
+    "Сообщение: Что ты любишь?\n"
+    "Название чата: Любимки Космокота 🥛📦\n\n"
+)
 
 
 def _build_title_prompt(first_message: str) -> str:
-    system_prompt = (
-        "Ты — эксперт по созданию названий чатов для космического кота Космокота. "
-        "Создай креативное, короткое название на основе первого сообщения пользователя. "
-        "Название должно быть забавным, включать кошачьи или космические эмодзи и отражать тему. "
-        "Оставайся в теме Космокота.\n\n"
-        "Примеры:\n"
-        "Сообщение: Привет, как дела?\n"
-        "Название чата: Привет от Космокота! 😺🚀\n\n"
-        "Сообщение: Расскажи о космосе.\n"
-        "Название чата: Космические тайны с котиком 🐱🌌\n\n"
-        "Сообщение: Что ты любишь?\n"
-        "Название чата: Любимки Космокота 🥛📦\n\n"
-        f"Сообщение: {first_message}\n"
-        "Название чата:"
-    )
-    return system_prompt
+    return _TITLE_SYSTEM_PROMPT + f"Сообщение: {first_message}\n" + "Название чата:"
+
+
+# Fallback titles when AI is not available
+_FALLBACK_TITLES = [
+    "Чат с Космокотом 🐱",
+    "Космические беседы 🚀",
+    "Мяу-диалоги 💫",
+    "Кот в космосе 🌙",
+    "Звёздный кот 🐾",
+    "Космокот онлайн 🛰️",
+    "Галактический чат 🌌",
+    "Котик в скафандре 👨‍🚀"
+]
 
 
 def generate_chat_title(first_message: str) -> str:
     """
-    Генерирует креативное название для чата на основе первого сообщения.
+    Генерирует креативное название для чата на основе первого сообщения
+    (в сервере инференса, если он задан).
     """
+    path = _get_inference_socket()
+    if path is None:
+        return _local_generate_chat_title(first_message)
+    try:
+        return _remote_call(path, {"op": "title", "first_message": first_message})["text"]
+    except Exception as e:
+        print(f"⚠️ Сервер инференса недоступен: {e}")
+        _fallback("title", "inference_server")
+        return random.choice(_FALLBACK_TITLES)
+
+
+def _local_generate_chat_title(first_message: str) -> str:
     if not _ensure_loaded():
-        # Fallback titles when AI is not available
-        fallback_titles = [
-            "Чат с Космокотом 🐱",
-            "Космические беседы 🚀",
-            "Мяу-диалоги 💫",
-            "Кот в космосе 🌙",
-            "Звёздный кот 🐾",
-            "Космокот онлайн 🛰️",
-            "Галактический чат 🌌",
-            "Котик в скафандре 👨‍🚀"
-        ]
-        return random.choice(fallback_titles)
+        _fallback("title", "model_unavailable")
+        return random.choice(_FALLBACK_TITLES)
 
     try:
         assert _tokenizer is not None and _model is not None
         prompt = _build_title_prompt(first_message)
-
-        inputs = _tokenizer(
-            prompt,
-            return_tensors="pt",
-            padding=False,
-            truncation=True,
-            max_length=256  # Увеличили немного
-        )
-
-        device = next(_model.parameters()).device
-        input_ids = inputs.input_ids.to(device)
-        attention_mask = inputs.attention_mask.to(device) if inputs.attention_mask is not None else None
-
-        with torch.no_grad():
-            outputs = _model.generate(
-                input_ids,
-                attention_mask=attention_mask,
-                max_new_tokens=30,  # Увеличили для лучших названий
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=_tokenizer.pad_token_id,
-                eos_token_id=_tokenizer.eos_token_id,
-                repetition_penalty=1.2,
-                no_repeat_ngram_size=2,
-                top_p=0.9,
-                top_k=40,
-            )
-
-        # Декодируем только новые токены
-        new_tokens = outputs[0][input_ids.shape[1]:]
-        title = _tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        title, timed_out = _complete("title", prompt)
 
         # Очистка названия
         title = re.split(r'[.!?\n]', title)[0].strip()
-        title = title[:50]
+        title = title[:_MAX_TITLE_CHARS]
+        if timed_out and not title:
+            _fallback("title", "deadline")
+            return random.choice(_FALLBACK_TITLES)
         
         # Добавляем эмодзи если его нет
         if not re.search(r'[\U0001F300-\U0001F6FF\U0001F900-\U0001F9FF]', title):
@@ -356,13 +1584,86 @@ def generate_chat_title(first_message: str) -> str:
 
     except Exception as e:
         print(f"❌ Ошибка генерации названия: {e}")
+        ERRORS.inc(kind="title")
+        _fallback("title", "error")
         return "Чат с Космокотом 🐱"
 
 
+# Состояние прогрева: idle (не запускался, модель грузится лениво),
+# loading, warming, ready или failed
+_warmup_state = "idle"
+_warmup_lock = threading.Lock()
+
+
+def _warmup(rounds: int) -> None:
+    """Загружает модель и прогоняет несколько холостых генераций (аллокаторы, ядра oneDNN)."""
+    global _warmup_state
+    started = time.monotonic()
+    if not _ensure_loaded():
+        _warmup_state = "failed"
+        return
+    _warmup_state = "warming"
+    try:
+        for _ in range(rounds):
+            _generate_texts("reply", [_build_prompt([{"role": "user", "content": "Привет!"}])])
+            _generate_texts("title", [_build_title_prompt("Привет!")])
+    except Exception as e:
+        print(f"⚠️ Ошибка прогрева модели: {e}")
+    _warmup_state = "ready"
+    print(f"✅ Модель прогрета за {time.monotonic() - started:.1f} с")
+
+
+def start_warmup(rounds: int = 2) -> None:
+    """Запускает загрузку и прогрев модели в фоновом потоке (повторный вызов ничего не делает)."""
+    global _warmup_state
+    if _get_inference_socket() is not None:
+        # Модель живёт в сервере инференса, здесь грузить нечего
+        return
+    with _warmup_lock:
+        if _warmup_state != "idle":
+            return
+        _warmup_state = "loading"
+    threading.Thread(target=_warmup, args=(rounds,), name="model-warmup", daemon=True).start()
+
+
+def get_readiness() -> Dict[str, Any]:
+    """
+    Готовность к приёму трафика. Если прогрев запускался, экземпляр готов
+    только после его завершения; без прогрева модель грузится лениво,
+    как раньше, и экземпляр считается готовым сразу.
+    С сервером инференса готовность — это его ответ на ping.
+    """
+    path = _get_inference_socket()
+    if path is not None:
+        try:
+            remote = _remote_call(path, {"op": "ping"}, timeout=2.0)
+        except Exception as e:
+            return {"ready": False, "inference_socket": path, "error": str(e)}
+        return {
+            "ready": bool(remote.get("ready")),
+            "inference_socket": path,
+            "warmup": remote.get("warmup"),
+            "model_loaded": remote.get("model_loaded"),
+            "precision": remote.get("precision"),
+        }
+    return {
+        "ready": _warmup_state in ("idle", "ready"),
+        "warmup": _warmup_state,
+        "model_loaded": _model_loaded,
+        "precision": _precision if _model_loaded else None,
+    }
+
+
+def get_cat_api_url() -> str:
+    """Адрес JSON-API случайных котов (CAT_API_URL, по умолчанию aleatori.cat) — для бенчмарков можно подставить заглушку."""
+    return os.environ.get("CAT_API_URL", "https://aleatori.cat/random.json")
+
+
 def get_random_cat() -> str:
     """Возвращает URL случайного кота с aleatori.cat"""
+    import requests
     try:
-        url = "https://aleatori.cat/random.json"
+        url = get_cat_api_url()
         resp = requests.get(url, timeout=5)
         resp.raise_for_status()
         data = resp.json()
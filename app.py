@@ -1,13 +1,21 @@
 from __future__ import annotations
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, send_file
+from typing import Optional
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, send_file, stream_with_context
 from flask_login import LoginManager, login_required, current_user
 import os
+import json
 
 import auth_manager
 import db_manager
 import ai_core
 import profile_manager
 import chat_manager
+import image_manager
+import admission_manager
+import metrics
+
+# Ответ ассистента, если генерация упала
+_GENERATION_ERROR_REPLY = "Мяу... Похоже, мои двигатели перегрелись. Попробуйте ещё раз."
 
 
 def create_app() -> Flask:
@@ -17,6 +25,10 @@ def create_app() -> Flask:
     # Init DB
     db_manager.init_db()
 
+    # Опционально грузим и прогреваем модель заранее, а не на первом запросе
+    if os.environ.get("AI_WARMUP", "0") == "1":
+        ai_core.start_warmup(int(os.environ.get("AI_WARMUP_ROUNDS", "2")))
+
     # Flask-Login setup
     login_manager = LoginManager(app)
     login_manager.login_view = "login"
@@ -60,12 +72,11 @@ def create_app() -> Flask:
         if request.method == "POST":
             login_value = request.form.get("login", "").strip()
             password = request.form.get("password", "")
-            if auth_manager.verify_login(login_value, password):
-                user = auth_manager.get_user_by_login(login_value)
-                if user:
-                    auth_manager.login_user_session(user)
-                    next_page = request.args.get('next')
-                    return redirect(next_page or url_for("platform"))
+            user = auth_manager.authenticate(login_value, password)
+            if user:
+                auth_manager.login_user_session(user)
+                next_page = request.args.get('next')
+                return redirect(next_page or url_for("platform"))
             flash("Неверный логин или пароль", "error")
         return render_template("login.html")
 
@@ -78,15 +89,13 @@ def create_app() -> Flask:
             if not login_value or not password:
                 flash("Укажите логин и пароль", "error")
                 return render_template("register.html")
-            ok = auth_manager.register_user(login_value, password, name)
-            if not ok:
+            user = auth_manager.register_user(login_value, password, name)
+            if not user:
                 flash("Такой логин уже существует", "error")
                 return render_template("register.html")
             # Auto-login after successful registration
-            user = auth_manager.get_user_by_login(login_value)
-            if user:
-                auth_manager.login_user_session(user)
-                return redirect(url_for("platform"))
+            auth_manager.login_user_session(user)
+            return redirect(url_for("platform"))
         return render_template("register.html")
 
     @app.route("/logout")
@@ -168,30 +177,148 @@ def create_app() -> Flask:
         if not _check_chat_access(chat_id, int(current_user.id)):
             return jsonify({'error': 'Чат не найден'}), 404
         
-        # Добавляем сообщение пользователя
-        chat_manager.append_message(chat_id, 'user', message)
-        
-        # Генерируем ответ ИИ
-        history = chat_manager.get_chat_history(chat_id)
+        # Место в очереди генерации; при перегрузке сразу отказываем, сообщение не сохраняем
+        admission = admission_manager.get_controller()
+        user_id = int(current_user.id)
         try:
-            reply = ai_core.generate_reply(history)
-        except Exception as e:
-            print(f"❌ Ошибка генерации ответа: {e}")
-            reply = "Мяу... Похоже, мои двигатели перегрелись. Попробуйте ещё раз."
+            started_at = admission.acquire(user_id)
+        except admission_manager.AdmissionRejected as e:
+            return _admission_rejected(e)
         
-        # Добавляем ответ ассистента
-        chat_manager.append_message(chat_id, 'assistant', reply)
+        try:
+            # Добавляем сообщение пользователя
+            chat_manager.append_message(chat_id, 'user', message)
+            
+            # Генерируем ответ ИИ по последним сообщениям диалога
+            history = chat_manager.get_chat_history(chat_id, limit=ai_core.CONTEXT_MESSAGES)
+            try:
+                reply = ai_core.generate_reply(history)
+            except Exception as e:
+                print(f"❌ Ошибка генерации ответа: {e}")
+                reply = _GENERATION_ERROR_REPLY
+            
+            # Добавляем ответ ассистента
+            chat_manager.append_message(chat_id, 'assistant', reply)
+        finally:
+            admission.release(user_id, started_at)
         
         return jsonify({'reply': reply})
 
+    @app.route("/api/send_message_stream", methods=["POST"])
+    @login_required
+    def api_send_message_stream():
+        """API endpoint для потоковой отправки сообщений (Server-Sent Events)"""
+        data = request.get_json()
+        chat_id = data.get('chat_id')
+        message = data.get('message', '').strip()
+
+        if not chat_id or not message:
+            return jsonify({'error': 'Неверные данные'}), 400
+
+        # Проверяем доступ к чату
+        if not _check_chat_access(chat_id, int(current_user.id)):
+            return jsonify({'error': 'Чат не найден'}), 404
+
+        # Место в очереди генерации держим до закрытия потокового ответа
+        admission = admission_manager.get_controller()
+        user_id = int(current_user.id)
+        try:
+            started_at = admission.acquire(user_id)
+        except admission_manager.AdmissionRejected as e:
+            return _admission_rejected(e)
+
+        try:
+            # Добавляем сообщение пользователя
+            chat_manager.append_message(chat_id, 'user', message)
+            history = chat_manager.get_chat_history(chat_id, limit=ai_core.CONTEXT_MESSAGES)
+        except Exception:
+            admission.release(user_id, started_at)
+            raise
+
+        def _events():
+            reply = None
+            shown = ""
+            saved = False
+            try:
+                try:
+                    for event in ai_core.stream_reply(history):
+                        if "delta" in event:
+                            shown += event["delta"]
+                            yield _sse("delta", {"text": event["delta"]})
+                        else:
+                            reply = event["reply"]
+                except Exception as e:
+                    print(f"❌ Ошибка генерации ответа: {e}")
+                if not reply:
+                    reply = _GENERATION_ERROR_REPLY
+
+                # Добавляем итоговый очищенный ответ ассистента
+                chat_manager.append_message(chat_id, 'assistant', reply)
+                saved = True
+                yield _sse("done", {"reply": reply})
+            finally:
+                # Клиент закрыл вкладку посреди потока (GeneratorExit) — сохраняем то,
+                # что он успел увидеть, чтобы сообщение пользователя не осталось без ответа
+                if not saved:
+                    chat_manager.append_message(chat_id, 'assistant', shown.strip() or _GENERATION_ERROR_REPLY)
+
+        response = Response(
+            stream_with_context(_events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        response.call_on_close(lambda: admission.release(user_id, started_at))
+        return response
+
+    @app.route("/api/chat/<string:chat_id>/title")
+    @login_required
+    def api_chat_title(chat_id: str):
+        """Текущее название чата и признак того, что оно ещё генерируется"""
+        if not _check_chat_access(chat_id, int(current_user.id)):
+            return jsonify({'error': 'Чат не найден'}), 404
+
+        chat_info = chat_manager.get_chat_info(chat_id)
+        return jsonify({
+            'title': chat_info['title'] if chat_info else None,
+            'pending': chat_manager.is_title_pending(chat_id),
+        })
+
+    @app.route("/healthz")
+    def healthz():
+        """Liveness: процесс жив и отвечает"""
+        return jsonify({"status": "ok"})
+
+    @app.route("/readyz")
+    def readyz():
+        """Readiness: модель загружена и прогрета (при AI_WARMUP=1)"""
+        readiness = ai_core.get_readiness()
+        return jsonify(readiness), 200 if readiness["ready"] else 503
+
+    @app.route("/internal/stats")
+    def internal_stats():
+        """Служебная статистика для мониторинга (очередь инференса и т.п.)"""
+        return jsonify({
+            "scheduler": ai_core.get_scheduler_stats(),
+            "generation": ai_core.get_generation_stats(),
+            "reply_cache": ai_core.get_reply_cache_stats(),
+            "admission": admission_manager.get_admission_stats(),
+            "avatar_pool": chat_manager.get_avatar_pool_stats(),
+        })
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        """Метрики генерации в текстовом формате Prometheus"""
+        return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
     @app.route("/user/<int:user_id>/avatar")
     def user_avatar(user_id: int):
         """Получить аватар пользователя"""
-        avatar_blob = profile_manager.get_user_avatar(user_id)
-        if not avatar_blob:
+        avatar = profile_manager.get_user_avatar(user_id, _requested_size(), _preferred_image_format())
+        if not avatar:
             # Вернуть дефолтный аватар из assets через отдельный маршрут
             return redirect(url_for('default_avatar'))
-        return Response(avatar_blob, mimetype="image/png")
+        # Аватар может смениться по тому же URL, поэтому браузер всегда перепроверяет ETag
+        return _cacheable_image(*avatar, max_age=0)
 
     @app.route("/assets/<path:filename>")
     def assets(filename):
@@ -207,23 +334,100 @@ def create_app() -> Flask:
             return send_file(assets_path, mimetype="image/png")
         return "", 404
 
+    @app.route("/img/<string:image_hash>")
+    def image(image_hash: str):
+        """Картинка из хранилища по хешу содержимого — по этому URL она никогда не меняется"""
+        stored = image_manager.get_image(image_hash)
+        if not stored:
+            return "", 404
+        data, mimetype = stored
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(image_hash)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+    @app.route("/chat/<string:chat_id>/icon")
+    def chat_icon(chat_id: str):
+        """Получить иконку чата для списка чатов"""
+        icon_blob = chat_manager.get_chat_icon(chat_id)
+        if not icon_blob:
+            return "", 404
+        return _cacheable_image(icon_blob, "image/png", max_age=86400)
+
     @app.route("/chat/<string:chat_id>/avatar")
+    @login_required
     def chat_avatar(chat_id: str):
         """Получить аватар чата"""
-        cat_avatar_blob = chat_manager.get_chat_avatar(chat_id)
-        if not cat_avatar_blob:
-            # Генерируем новый аватар
+        # Без проверки владельца любой мог бы наполнять хранилище картинками для несуществующих чатов
+        if not _check_chat_access(chat_id, int(current_user.id)):
+            return "", 404
+        size, image_format = _requested_size(), _preferred_image_format()
+        avatar = chat_manager.get_chat_avatar(chat_id, size, image_format)
+        if not avatar:
+            # Генерируем новый аватар и сохраняем его, чтобы не качать кота заново
             cat_avatar_blob = _generate_chat_avatar(chat_id)
+            if cat_avatar_blob:
+                chat_manager.update_chat_avatar(chat_id, cat_avatar_blob)
+                avatar = chat_manager.get_chat_avatar(chat_id, size, image_format)
             
-        if not cat_avatar_blob:
+        if not avatar:
             return "", 204
             
-        return Response(cat_avatar_blob, mimetype="image/png")
+        # Аватар отдаётся только владельцу чата — общим кешам его хранить нельзя
+        return _cacheable_image(*avatar, max_age=86400, private=True)
+
+    @app.cli.command("backfill-images")
+    def backfill_images_command():
+        """Перенести аватары и иконки из строк users/chats в хранилище картинок"""
+        result = image_manager.backfill_images()
+        print(f"✅ Перенесено: {result}")
+
+    def _requested_size() -> Optional[int]:
+        """Размер аватара из ?size= (в пикселях); без параметра — исходный"""
+        size = request.args.get("size", type=int)
+        return size if size and size > 0 else None
+
+    def _preferred_image_format() -> str:
+        """WebP, если браузер явно перечислил его в Accept (*/* и image/* не в счёт), иначе PNG"""
+        accepts_webp = any(m == "image/webp" for m, q in request.accept_mimetypes if q > 0)
+        return "webp" if accepts_webp else "png"
+
+    def _cacheable_image(blob: bytes, mimetype: str, max_age: int, private: bool = False) -> Response:
+        """
+        Ответ-картинка со строгим ETag (хеш содержимого) и Cache-Control;
+        на совпадающий If-None-Match отвечает 304 без тела.
+        max_age=0 — кешировать можно, но перед использованием надо перепроверить.
+        private=True — только кеш браузера (картинка доступна не всем).
+        Формат выбирается по Accept, поэтому кеши должны различать ответы по нему.
+        """
+        response = Response(blob, mimetype=mimetype)
+        response.vary.add("Accept")
+        response.add_etag()
+        if private:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if max_age == 0:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def _admission_rejected(error: admission_manager.AdmissionRejected) -> Response:
+        """429/503 с сообщением Космокота и подсказкой, когда повторить"""
+        response = jsonify({'error': error.message, 'retry_after': error.retry_after})
+        response.status_code = error.status
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response
 
     def _check_chat_access(chat_id: str, user_id: int) -> bool:
         """Проверяет принадлежит ли чат пользователю"""
-        user_chats = chat_manager.list_chats(user_id)
-        return any(chat['chat_id'] == chat_id for chat in user_chats)
+        return chat_manager.user_owns_chat(chat_id, user_id)
+
+    def _sse(event: str, payload: dict) -> str:
+        """Форматирует одно событие Server-Sent Events"""
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
     def _generate_chat_avatar(chat_id: str) -> bytes:
         """Генерирует аватар для чата используя aleatori.cat"""
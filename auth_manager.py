@@ -1,6 +1,11 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, Tuple
+from collections import OrderedDict
+import os
+import threading
+import time
 from flask_login import UserMixin, login_user, logout_user
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 import db_manager
 
@@ -13,38 +18,121 @@ class AuthUser(UserMixin):
 def _to_auth_user(u: db_manager.User) -> AuthUser:
     return AuthUser(user_id=u.id, login=u.login, name=u.name)
 
-def register_user(login: str, password: str, name: Optional[str] = None) -> bool:
-    with db_manager.get_session() as session:
-        existing = session.query(db_manager.User).filter(db_manager.User.login == login).first()
-        if existing is not None:
-            return False
-        password_hash = generate_password_hash(password)
-        user = db_manager.User(login=login, password_hash=password_hash, name=name)
-        session.add(user)
-    return True
-
-def verify_login(login: str, password: str) -> bool:
+# Кеш AuthUser для user_loader: иначе каждый запрос залогиненного пользователя ходит в БД.
+# Запись живёт AUTH_USER_CACHE_TTL секунд (это же предел рассинхронизации между процессами),
+# в кеше не больше AUTH_USER_CACHE_SIZE пользователей, лишние вытесняются по LRU.
+_user_cache: "OrderedDict[int, Tuple[float, AuthUser]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def _get_user_cache_ttl() -> float:
+    return float(os.environ.get("AUTH_USER_CACHE_TTL", "60"))
+
+def _get_user_cache_size() -> int:
+    return int(os.environ.get("AUTH_USER_CACHE_SIZE", "1024"))
+
+def _cached_user(uid: int) -> Optional[AuthUser]:
+    with _user_cache_lock:
+        entry = _user_cache.get(uid)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del _user_cache[uid]
+            return None
+        _user_cache.move_to_end(uid)
+        return user
+
+def _cache_user(user: AuthUser) -> None:
+    ttl, max_size = _get_user_cache_ttl(), _get_user_cache_size()
+    if ttl <= 0 or max_size <= 0:
+        return
+    with _user_cache_lock:
+        _user_cache[int(user.id)] = (time.monotonic() + ttl, user)
+        _user_cache.move_to_end(int(user.id))
+        while len(_user_cache) > max_size:
+            _user_cache.popitem(last=False)
+
+def invalidate_user(user_id: str | int) -> None:
+    """Сбросить пользователя из кеша после изменения его данных."""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
+# Параметры хеширования паролей в формате werkzeug: "scrypt:N:r:p" или "pbkdf2:sha256:итерации".
+# Хеши со старыми параметрами пересчитываются при следующем успешном входе.
+_DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+_dummy_hashes: dict = {}
+
+def _get_password_hash_method() -> str:
+    return os.environ.get("PASSWORD_HASH_METHOD", _DEFAULT_PASSWORD_HASH_METHOD)
+
+def hash_password(password: str) -> str:
+    return generate_password_hash(password, method=_get_password_hash_method())
+
+def _dummy_hash() -> str:
+    """Фиктивный хеш с текущими параметрами (считается один раз на метод)."""
+    method = _get_password_hash_method()
+    if method not in _dummy_hashes:
+        _dummy_hashes[method] = hash_password("cosmocats")
+    return _dummy_hashes[method]
+
+def _needs_rehash(password_hash: str) -> bool:
+    # Префикс берём из настоящего хеша: werkzeug дописывает параметры по умолчанию ("scrypt" -> "scrypt:32768:8:1")
+    return password_hash.split("$", 1)[0] != _dummy_hash().split("$", 1)[0]
+
+def _check_unknown_login(password: str) -> None:
+    """Проверка против фиктивного хеша: неизвестный логин отвечает так же долго, как неверный пароль."""
+    check_password_hash(_dummy_hash(), password)
+
+def register_user(login: str, password: str, name: Optional[str] = None) -> Optional[AuthUser]:
+    """Создаёт пользователя; None — если логин занят (проверяет уникальный индекс, без лишнего SELECT)."""
+    user = db_manager.User(login=login, password_hash=hash_password(password), name=name)
+    try:
+        with db_manager.get_session() as session:
+            session.add(user)
+            session.flush()
+            return _to_auth_user(user)
+    except IntegrityError:
+        return None
+
+def authenticate(login: str, password: str) -> Optional[AuthUser]:
+    """Проверяет логин и пароль одним запросом и возвращает пользователя (None — если не подошли)."""
     with db_manager.get_session() as session:
-        user = session.query(db_manager.User).filter(db_manager.User.login == login).first()
-        if user is None:
-            return False
-        return check_password_hash(user.password_hash, password)
+        row = (
+            session.query(db_manager.User.id, db_manager.User.login, db_manager.User.name, db_manager.User.password_hash)
+            .filter(db_manager.User.login == login)
+            .first()
+        )
+        if row is None:
+            _check_unknown_login(password)
+            return None
+        if not check_password_hash(row.password_hash, password):
+            return None
+        if _needs_rehash(row.password_hash):
+            session.query(db_manager.User).filter(db_manager.User.id == row.id).update(
+                {db_manager.User.password_hash: hash_password(password)}, synchronize_session=False
+            )
+        return AuthUser(user_id=row.id, login=row.login, name=row.name)
 
 def get_user_by_id(user_id: str | int) -> Optional[AuthUser]:
     try:
         uid = int(user_id)
     except Exception:
         return None
+    cached = _cached_user(uid)
+    if cached is not None:
+        return cached
+    # Только нужные колонки: avatar_blob на пути авторизации не читаем
     with db_manager.get_session() as session:
-        user = session.get(db_manager.User, uid)
-        if user is None:
-            return None
-        return _to_auth_user(user)
-
-def get_user_by_login(login: str) -> Optional[AuthUser]:
-    with db_manager.get_session() as session:
-        user = session.query(db_manager.User).filter(db_manager.User.login == login).first()
-        return _to_auth_user(user) if user else None
+        row = (
+            session.query(db_manager.User.id, db_manager.User.login, db_manager.User.name)
+            .filter(db_manager.User.id == uid)
+            .first()
+        )
+    if row is None:
+        return None
+    user = AuthUser(user_id=row.id, login=row.login, name=row.name)
+    _cache_user(user)
+    return user
 
 def login_user_session(user: AuthUser, remember: bool = False) -> None:
     login_user(user, remember=remember)
@@ -0,0 +1,88 @@
+"""
+Проверка бюджета времени старта: импорт веб-приложения не должен тянуть
+torch/transformers и должен укладываться в IMPORT_BUDGET_MS.
+
+Запускает `python -X importtime -c "import app"` в чистом процессе --runs раз
+(в зачёт идёт самый быстрый прогон, чтобы фоновая нагрузка на машине не валила
+проверку), разбирает вывод и печатает самые тяжёлые модули. Код возврата 1 —
+бюджет превышен или импортирован тяжёлый ML-модуль (удобно для CI или pre-commit).
+
+Запуск из корня репозитория:
+    python benchmarks/check_import_time.py [--module app] [--budget-ms 1500] [--runs 3] [--top 10]
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые должны импортироваться только при первой генерации
+HEAVY_MODULES = ("torch", "transformers")
+
+
+def _parse_importtime(stderr: str) -> list:
+    """Строки вида 'import time: self [us] | cumulative | name' -> [(cumulative_us, self_us, name)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+def _measure(module: str) -> tuple:
+    """Один импорт в чистом процессе: (строки importtime, общее время импорта модуля в мс)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.strip()[-2000:])
+        sys.exit(1)
+    rows = _parse_importtime(proc.stderr)
+    total_ms = next((cumulative for cumulative, _, name in rows if name.strip() == module), 0) / 1000
+    return rows, total_ms
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="какой модуль импортировать")
+    parser.add_argument("--budget-ms", type=float,
+                        default=float(os.environ.get("IMPORT_BUDGET_MS", "1500")),
+                        help="допустимое время импорта, мс")
+    parser.add_argument("--runs", type=int, default=3, help="сколько раз импортировать (берётся самый быстрый)")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых тяжёлых модулей показать")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(max(1, args.runs)):
+        rows, total_ms = _measure(args.module)
+        if best is None or total_ms < best[1]:
+            best = (rows, total_ms)
+    rows, total_ms = best
+    heavy = sorted({name.strip().split(".")[0] for _, _, name in rows
+                    if name.strip().split(".")[0] in HEAVY_MODULES})
+
+    print(f"{'cumulative,ms':>14} {'self,ms':>9}  module")
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+    print(f"\nimport {args.module}: {total_ms:.0f} мс, лучший из {max(1, args.runs)} (бюджет {args.budget_ms:.0f} мс)")
+
+    failed = False
+    if heavy:
+        print(f"❌ При импорте {args.module} загружены тяжёлые модули: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("❌ Бюджет времени импорта превышен")
+        failed = True
+    if not failed:
+        print("✅ Импорт укладывается в бюджет")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
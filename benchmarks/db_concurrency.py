@@ -0,0 +1,119 @@
+"""
+Конкурентная запись в SQLite: профиль движка по умолчанию против DB_PROFILE=production
+(WAL, synchronous=NORMAL, busy_timeout, пул соединений).
+
+Во временной базе несколько потоков одновременно дописывают сообщения в свои чаты
+(chat_manager.append_message) и читают историю (get_chat_history), как делают
+запросы /api/send_message. Каждый профиль запускается в отдельном процессе.
+Выводятся записи/с, чтения/с и число ошибок "database is locked".
+
+Запуск из корня репозитория:
+    python benchmarks/db_concurrency.py [--profiles default,production] [--threads 8] [--writes 200] [--json out.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_profile(threads: int, writes: int, database_url: str) -> dict:
+    """Замеры внутри дочернего процесса; профиль уже задан через DB_PROFILE."""
+    sys.path.insert(0, ROOT)
+    from sqlalchemy.exc import OperationalError
+    import db_manager
+    import chat_manager
+
+    db_manager.init_db(database_url)
+    with db_manager.get_session() as session:
+        user = db_manager.User(login="bench", password_hash="-")
+        session.add(user)
+        session.flush()
+        for i in range(threads):
+            session.add(db_manager.Chat(user_id=user.id, chat_id=f"bench{i}", title="bench"))
+
+    counters = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+
+    def worker(index: int) -> None:
+        chat_id = f"bench{index}"
+        start.wait()
+        for n in range(writes):
+            try:
+                chat_manager.append_message(chat_id, "assistant", f"Мяу {n}")
+                chat_manager.get_chat_history(chat_id, limit=4)
+                with lock:
+                    counters["writes"] += 1
+                    counters["reads"] += 1
+            except OperationalError:
+                with lock:
+                    counters["locked"] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    started = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "writes_per_second": round(counters["writes"] / elapsed, 1),
+        "reads_per_second": round(counters["reads"] / elapsed, 1),
+        "locked_errors": counters["locked"],
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="default,production", help="профили через запятую")
+    parser.add_argument("--threads", type=int, default=8, help="потоков-писателей")
+    parser.add_argument("--writes", type=int, default=200, help="сообщений на поток")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--database-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_profile(args.threads, args.writes, args.database_url)))
+        return
+
+    results = {}
+    for profile in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            env = dict(os.environ, DB_PROFILE=profile, AVATAR_POOL_SIZE="0")
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", profile,
+                 "--threads", str(args.threads), "--writes", str(args.writes),
+                 "--database-url", database_url],
+                env=env, capture_output=True, text=True,
+            )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        results[profile] = json.loads(lines[-1]) if lines else {"error": proc.stderr.strip()[-500:]}
+
+    print(f"{'profile':<11} {'writes/s':>9} {'reads/s':>9} {'locked':>7} {'seconds':>8}")
+    for profile, r in results.items():
+        if "error" in r:
+            print(f"{profile:<11} error: {r['error']}")
+            continue
+        print(f"{profile:<11} {r['writes_per_second']:>9} {r['reads_per_second']:>9} "
+              f"{r['locked_errors']:>7} {r['seconds']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
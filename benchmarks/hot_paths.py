@@ -0,0 +1,449 @@
+"""
+Бенчмарки горячих путей запроса, полностью офлайн и воспроизводимо.
+
+Всё работает во временной SQLite-базе. Вместо модели — локальная заглушка
+сервера инференса (тот же протокол, что у inference_server.py, ответ через
+--model-ms миллисекунд), вместо aleatori.cat — локальный HTTP-сервер с
+синтетической картинкой (через CAT_API_URL). Разделы:
+
+    prompt   — ai_core._build_prompt и ai_core._finalize_reply, операций/с
+    history  — chat_manager.append_message и get_chat_history при разной
+               длине истории; legacy_* — прежнее хранение истории блобом
+               (db_manager.serialize_history / deserialize_history, теперь
+               только для миграции) как база для сравнения
+    chats    — chat_manager.list_chats у пользователей с 10/100/1000 чатами
+    images   — chat_manager._circle_crop и profile_manager._prepare_avatar_1024
+               на фотографиях разного размера
+    e2e      — POST /api/send_message через тестовый клиент Flask при разной
+               конкурентности: задержки p50/p95/p99 и запросов/с
+
+Результаты пишутся в JSON вместе с коммитом и версией Python; --compare
+сравнивает с сохранённым ранее прогоном (например, с прошлого коммита).
+
+Запуск из корня репозитория:
+    python benchmarks/hot_paths.py [--sections prompt,history,chats,images,e2e] [--quick]
+                                   [--json out.json] [--compare old.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECTIONS = ("prompt", "history", "chats", "images", "e2e")
+
+HISTORY_SIZES = (10, 100, 1000)
+CHAT_COUNTS = (10, 100, 1000)
+IMAGE_SIZES = ((640, 480), (1600, 1200), (2000, 1500))
+CONCURRENCY_LEVELS = (1, 4, 8, 16)
+
+STUB_REPLY = "Мяу! Я Космокот, летаю между звёздами и очень люблю рыбку 🐟 А ты любишь космос?"
+
+# Сырые ответы модели с типичным мусором, который вычищает _finalize_reply
+RAW_REPLIES = [
+    "Мяу! Сегодня на орбите тихо, только звёзды мерцают 🌟\nПользователь: а ты",
+    "  Космокот: Я люблю рыбку и спать на тёплой антенне.\n\nUser: Привет",
+    "Мур-мур, конечно! Марс красный, потому что там много ржавчины 🪐 Ассистент: ещё",
+    "Мяу... не знаю такого слова, но звучит вкусно!!! 🐾🐾🐾 <|endoftext|>",
+]
+
+USER_MESSAGES = [
+    "Привет, котик!",
+    "Расскажи, как ты попал в космос?",
+    "Что ты ешь на космической станции?",
+    "Какая самая красивая планета?",
+]
+
+
+def _stats(samples: list) -> dict:
+    """Сводка по замерам в секундах: среднее, перцентили (мкс) и операций/с."""
+    ordered = sorted(samples)
+
+    def pct(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    mean = statistics.fmean(ordered)
+    return {
+        "n": len(ordered),
+        "mean_us": round(mean * 1e6, 1),
+        "p50_us": round(pct(0.50) * 1e6, 1),
+        "p95_us": round(pct(0.95) * 1e6, 1),
+        "ops_per_second": round(1 / mean, 1) if mean else None,
+    }
+
+
+def _measure(fn, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _stats(samples)
+
+
+def _history(length: int) -> list:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": USER_MESSAGES[i % len(USER_MESSAGES)] if i % 2 == 0 else STUB_REPLY}
+        for i in range(length)
+    ]
+
+
+def _photo(width: int, height: int, seed: int = 0) -> bytes:
+    """Синтетическая «фотография»: градиент, шум и пятна — JPEG сжимается примерно как снимок с телефона."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rnd = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    im = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(40):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(10, max(11, min(width, height) // 5))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    im = im.filter(ImageFilter.GaussianBlur(1.5))
+    out = BytesIO()
+    im.save(out, format="JPEG", quality=88)
+    return out.getvalue()
+
+
+# --- Заглушки внешних зависимостей -------------------------------------------
+
+def _start_cat_stub() -> str:
+    """Локальный aleatori.cat: /random.json отдаёт ссылку на /cat.jpg. Возвращает адрес для CAT_API_URL."""
+    image = _photo(800, 600, seed=42)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == "/random.json":
+                body = json.dumps({"id": 1, "url": f"http://127.0.0.1:{server.server_port}/cat.jpg"}).encode()
+                content_type = "application/json"
+            elif self.path == "/cat.jpg":
+                body, content_type = image, "image/jpeg"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="cat-stub", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/random.json"
+
+
+def _start_model_stub(path: str, model_ms: float) -> None:
+    """Заглушка сервера инференса по протоколу inference_server.py: фиксированный ответ через model_ms."""
+    from inference_server import send_message, recv_message
+
+    def handle(conn: socket.socket) -> None:
+        with conn:
+            while True:
+                request = recv_message(conn)
+                if request is None:
+                    return
+                op = request.get("op")
+                if op == "ping":
+                    send_message(conn, {"ok": True, "ready": True, "warmup": "ready", "model_loaded": True})
+                    continue
+                time.sleep(model_ms / 1000)
+                if op == "stream":
+                    send_message(conn, {"delta": STUB_REPLY})
+                    send_message(conn, {"reply": STUB_REPLY})
+                else:
+                    send_message(conn, {"ok": True, "text": STUB_REPLY if op == "reply" else "Космический чат"})
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+
+    def accept_loop() -> None:
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, name="model-stub", daemon=True).start()
+
+
+# --- Разделы ------------------------------------------------------------------
+
+def bench_prompt(repeat: int) -> dict:
+    import ai_core
+
+    results = {}
+    for length in (1, ai_core.CONTEXT_MESSAGES, 20):
+        messages = _history(length)
+        results[f"build_prompt_{length}_messages"] = _measure(lambda: ai_core._build_prompt(messages), repeat)
+    cycle = iter(RAW_REPLIES * (repeat + 10))
+    results["finalize_reply"] = _measure(lambda: ai_core._finalize_reply(next(cycle)), repeat)
+    return results
+
+
+def bench_history(repeat: int) -> dict:
+    from sqlalchemy import insert
+    import chat_manager
+    import db_manager
+
+    results = {}
+    with db_manager.get_session() as session:
+        user = db_manager.User(login="bench-history", password_hash="-")
+        session.add(user)
+        session.flush()
+        user_id = user.id
+    for length in HISTORY_SIZES:
+        messages = _history(length)
+        # До таблицы messages история хранилась блобом — оставлено только для сравнения
+        blob = db_manager.serialize_history(messages)
+        results[f"legacy_serialize_{length}"] = _measure(lambda: db_manager.serialize_history(messages), repeat)
+        results[f"legacy_deserialize_{length}"] = _measure(lambda: db_manager.deserialize_history(blob), repeat)
+
+        chat_id = f"history-{length}"
+        with db_manager.get_session() as session:
+            session.add(db_manager.Chat(user_id=user_id, chat_id=chat_id, title="bench"))
+            session.flush()
+            session.execute(insert(db_manager.Message), [
+                {"chat_id": chat_id, "seq": seq, "role": m["role"], "content": m["content"]}
+                for seq, m in enumerate(messages, start=1)
+            ])
+        results[f"append_message_{length}"] = _measure(
+            lambda: chat_manager.append_message(chat_id, "assistant", STUB_REPLY), repeat
+        )
+        results[f"get_chat_history_{length}"] = _measure(
+            lambda: chat_manager.get_chat_history(chat_id, limit=4), repeat
+        )
+    return results
+
+
+def bench_chats(repeat: int) -> dict:
+    import chat_manager
+    import db_manager
+
+    results = {}
+    for count in CHAT_COUNTS:
+        with db_manager.get_session() as session:
+            user = db_manager.User(login=f"bench-chats-{count}", password_hash="-")
+            session.add(user)
+            session.flush()
+            session.add_all(
+                db_manager.Chat(user_id=user.id, chat_id=f"chats-{count}-{i}", title=f"Чат {i}", icon_hash=f"{i:064x}")
+                for i in range(count)
+            )
+            user_id = user.id
+        results[f"list_chats_{count}"] = _measure(lambda: chat_manager.list_chats(user_id), repeat)
+    return results
+
+
+def bench_images(repeat: int) -> dict:
+    import chat_manager
+    import profile_manager
+
+    results = {}
+    for width, height in IMAGE_SIZES:
+        photo = _photo(width, height)
+        name = f"{width}x{height}"
+        results[f"circle_crop_500_{name}"] = _measure(lambda: chat_manager._circle_crop(photo, 500), repeat, warmup=1)
+        results[f"prepare_avatar_1024_{name}"] = _measure(
+            lambda: profile_manager._prepare_avatar_1024(photo), repeat, warmup=1
+        )
+        results[f"photo_{name}_kb"] = round(len(photo) / 1024, 1)
+    avatar = chat_manager._circle_crop(_photo(800, 600), 500)
+    results["circle_crop_64_from_500"] = _measure(lambda: chat_manager._circle_crop(avatar, 64), repeat)
+    return results
+
+
+def bench_e2e(app, requests_per_client: int) -> dict:
+    results = {}
+    for concurrency in CONCURRENCY_LEVELS:
+        clients = []
+        for i in range(concurrency):
+            client = app.test_client()
+            login = f"e2e-{concurrency}-{i}"
+            client.post("/register", data={"login": login, "password": "bench-password", "name": "Bench"})
+            chat_id = client.post("/chat/new").headers["Location"].rstrip("/").rsplit("/", 1)[-1]
+            client.post("/api/send_message", json={"chat_id": chat_id, "message": "Привет!"})
+            clients.append((client, chat_id))
+
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        barrier = threading.Barrier(concurrency + 1)
+
+        def worker(client, chat_id: str) -> None:
+            barrier.wait()
+            for n in range(requests_per_client):
+                started = time.perf_counter()
+                response = client.post("/api/send_message", json={
+                    "chat_id": chat_id, "message": USER_MESSAGES[n % len(USER_MESSAGES)],
+                })
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        pool = [threading.Thread(target=worker, args=pair) for pair in clients]
+        for t in pool:
+            t.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for t in pool:
+            t.join()
+        wall = time.perf_counter() - started
+
+        ordered = sorted(latencies)
+        results[f"concurrency_{concurrency}"] = {
+            "requests": len(ordered),
+            "requests_per_second": round(len(ordered) / wall, 1),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 2),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000, 2),
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        }
+    return results
+
+
+# --- Запуск и сравнение -------------------------------------------------------
+
+def _git_commit() -> str:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() or "unknown"
+
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _compare(old: dict, new: dict) -> None:
+    """Печатает изменения ключевых величин: время (меньше — лучше) и пропускную способность (больше — лучше)."""
+    old_flat, new_flat = _flatten(old["results"]), _flatten(new["results"])
+    print(f"\nсравнение с {old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'metric':<58} {'old':>11} {'new':>11} {'change':>8}")
+    for name, value in new_flat.items():
+        if not name.endswith(("p50_us", "p50_ms", "p95_ms", "ops_per_second", "requests_per_second")):
+            continue
+        before = old_flat.get(name)
+        if not before:
+            continue
+        print(f"{name:<58} {before:>11} {value:>11} {(value / before - 1) * 100:>+7.1f}%")
+
+
+def _print_results(results: dict) -> None:
+    for section, rows in results.items():
+        print(f"\n[{section}]")
+        for name, row in rows.items():
+            if not isinstance(row, dict):
+                print(f"  {name:<36} {row}")
+            elif "ops_per_second" in row:
+                print(f"  {name:<36} p50 {row['p50_us']:>10} мкс  p95 {row['p95_us']:>10} мкс  "
+                      f"{row['ops_per_second']:>10} оп/с")
+            else:
+                print(f"  {name:<36} p50 {row['p50_ms']:>8} мс  p95 {row['p95_ms']:>8} мс  "
+                      f"p99 {row['p99_ms']:>8} мс  {row['requests_per_second']:>7} зап/с  {row['statuses']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", default=",".join(SECTIONS), help="разделы через запятую")
+    parser.add_argument("--repeat", type=int, default=200, help="повторов микробенчмарка")
+    parser.add_argument("--requests", type=int, default=50, help="запросов на клиента в разделе e2e")
+    parser.add_argument("--model-ms", type=float, default=0.0, help="задержка ответа заглушки модели, мс")
+    parser.add_argument("--quick", action="store_true", help="меньше повторов — для быстрой проверки")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора случайных чисел")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"неизвестные разделы: {', '.join(sorted(unknown))}")
+    repeat = 20 if args.quick else args.repeat
+    requests_per_client = 5 if args.quick else args.requests
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Окружение задаётся до импорта приложения: все внешние зависимости — локальные заглушки
+        socket_path = os.path.join(tmp, "model.sock")
+        _start_model_stub(socket_path, args.model_ms)
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            AI_INFERENCE_SOCKET=socket_path,
+            CAT_API_URL=_start_cat_stub(),
+            AVATAR_POOL_SIZE="0",
+            AI_REPLY_CACHE="0",
+        )
+        os.environ.setdefault("AI_MAX_CONCURRENT", str(max(CONCURRENCY_LEVELS)))
+        os.environ.setdefault("NO_PROXY", "127.0.0.1")
+
+        import app as app_module
+
+        app = app_module.create_app()
+        app.testing = True
+
+        results = {}
+        for section in sections:
+            print(f"ℹ️ Раздел {section}...", flush=True)
+            if section == "prompt":
+                results[section] = bench_prompt(repeat * 10)
+            elif section == "history":
+                results[section] = bench_history(repeat)
+            elif section == "chats":
+                results[section] = bench_chats(repeat)
+            elif section == "images":
+                results[section] = bench_images(max(3, repeat // 20))
+            elif section == "e2e":
+                results[section] = bench_e2e(app, requests_per_client)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "requests_per_client": requests_per_client,
+            "model_ms": args.model_ms,
+        },
+        "results": results,
+    }
+    _print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            _compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
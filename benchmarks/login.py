@@ -0,0 +1,89 @@
+"""
+Пропускная способность входа (логинов в секунду на одно ядро) для разных
+параметров хеширования паролей (PASSWORD_HASH_METHOD).
+
+Для каждого метода во временной SQLite-базе регистрируются пользователи,
+затем в одном потоке выполняется auth_manager.authenticate — один поток
+занимает одно ядро, так что логины/с здесь и есть логины/с на ядро.
+Дополнительно считается число SQL-запросов на один вход.
+
+Запуск из корня репозитория:
+    python benchmarks/login.py [--methods scrypt:32768:8:1,pbkdf2:sha256:600000] [--logins 20] [--json out.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_METHODS = "scrypt:32768:8:1,scrypt:16384:8:1,pbkdf2:sha256:600000,pbkdf2:sha256:100000"
+PASSWORD = "correct horse battery staple"
+
+
+def _bench_method(method: str, logins: int, users: int) -> dict:
+    from sqlalchemy import event
+    import auth_manager
+    import db_manager
+
+    os.environ["PASSWORD_HASH_METHOD"] = method
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager.init_db(f"sqlite:///{os.path.join(tmp, 'login.db')}")
+        started = time.perf_counter()
+        for i in range(users):
+            auth_manager.register_user(f"user{i}", PASSWORD)
+        register_seconds = (time.perf_counter() - started) / users
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db_manager._engine, "before_cursor_execute", listener)
+        started = time.perf_counter()
+        for i in range(logins):
+            assert auth_manager.authenticate(f"user{i % users}", PASSWORD) is not None
+        elapsed = time.perf_counter() - started
+        event.remove(db_manager._engine, "before_cursor_execute", listener)
+
+        auth_manager.authenticate("nobody", PASSWORD)  # фиктивный хеш считается один раз
+        failed_started = time.perf_counter()
+        auth_manager.authenticate("nobody", PASSWORD)
+        unknown_login_ms = (time.perf_counter() - failed_started) * 1000
+        db_manager._engine.dispose()
+
+    return {
+        "logins_per_second": round(logins / elapsed, 1),
+        "login_ms": round(elapsed / logins * 1000, 2),
+        "register_ms": round(register_seconds * 1000, 2),
+        "unknown_login_ms": round(unknown_login_ms, 2),
+        "queries_per_login": round(len(statements) / logins, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", default=DEFAULT_METHODS, help="методы хеширования через запятую")
+    parser.add_argument("--logins", type=int, default=20, help="сколько входов мерить для каждого метода")
+    parser.add_argument("--users", type=int, default=5, help="сколько пользователей зарегистрировать")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    results = {}
+    for method in [m.strip() for m in args.methods.split(",") if m.strip()]:
+        results[method] = _bench_method(method, args.logins, args.users)
+
+    print(f"{'method':<24} {'logins/s':>9} {'login,ms':>9} {'register,ms':>12} {'unknown,ms':>11} {'queries':>8}")
+    for method, r in results.items():
+        print(f"{method:<24} {r['logins_per_second']:>9} {r['login_ms']:>9} {r['register_ms']:>12} "
+              f"{r['unknown_login_ms']:>11} {r['queries_per_login']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
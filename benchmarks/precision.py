@@ -0,0 +1,127 @@
+"""
+Сравнение режимов точности инференса (AI_PRECISION): fp32 / bf16 / int8.
+
+Каждый режим запускается в отдельном процессе, чтобы честно мерить память.
+Для каждого режима выводятся: время загрузки, объём весов, пиковый RSS,
+скорость генерации (токенов/с) и качество — перплексия модели на примерах
+диалогов из системного промпта плюс несколько ответов для ручной проверки.
+
+Запуск из корня репозитория:
+    python benchmarks/precision.py [--modes fp32,int8] [--tokens 40] [--json out.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = [
+    "Привет!",
+    "Как дела?",
+    "Расскажи о себе.",
+    "Что ты любишь есть?",
+    "Какая сегодня погода в космосе?",
+]
+
+
+def _run_mode(new_tokens: int, samples: int) -> dict:
+    """Замеры внутри дочернего процесса; режим уже задан через AI_PRECISION."""
+    sys.path.insert(0, ROOT)
+    import random
+    import torch
+    import ai_core
+
+    started = time.perf_counter()
+    if not ai_core._ensure_loaded():
+        return {"error": "model not available"}
+    load_seconds = time.perf_counter() - started
+    model, tokenizer = ai_core._model, ai_core._tokenizer
+
+    # Перплексия на эталонных репликах Космокота из системного промпта
+    ids = tokenizer(ai_core._REPLY_SYSTEM_PROMPT, return_tensors="pt").input_ids
+    with torch.no_grad():
+        loss = model(ids, labels=ids).loss.float().item()
+
+    # Скорость: фиксированное число токенов без ранней остановки
+    prompts = [ai_core._build_prompt([{"role": "user", "content": p}]) for p in PROMPTS]
+    generated = 0
+    elapsed = 0.0
+    for prompt in prompts:
+        input_ids, attention_mask, past_key_values = ai_core._encode_batch("reply", [prompt])
+        started = time.perf_counter()
+        with torch.no_grad():
+            out = model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        elapsed += time.perf_counter() - started
+        generated += out.shape[1] - input_ids.shape[1]
+
+    random.seed(0)
+    torch.manual_seed(0)
+    replies = [ai_core.generate_reply([{"role": "user", "content": p}]) for p in PROMPTS[:samples]]
+
+    return {
+        "precision": ai_core._precision,
+        "load_seconds": round(load_seconds, 2),
+        "weights_mb": round(ai_core._model_footprint_mb(model), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "tokens_per_second": round(generated / elapsed, 1) if elapsed else 0.0,
+        "perplexity": round(float(torch.exp(torch.tensor(loss))), 2),
+        "replies": replies,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="fp32,bf16,int8", help="режимы через запятую")
+    parser.add_argument("--tokens", type=int, default=40, help="токенов на промпт при замере скорости")
+    parser.add_argument("--samples", type=int, default=3, help="сколько ответов показать для оценки качества")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_mode(args.tokens, args.samples), ensure_ascii=False))
+        return
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        env = dict(os.environ, AI_PRECISION=mode)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", mode,
+             "--tokens", str(args.tokens), "--samples", str(args.samples)],
+            env=env, capture_output=True, text=True,
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        results[mode] = json.loads(lines[-1]) if lines else {"error": proc.stderr.strip()[-500:]}
+
+    print(f"{'mode':<6} {'effective':<10} {'load,s':>7} {'weights,MB':>11} {'RSS,MB':>8} {'tok/s':>7} {'ppl':>8}")
+    for mode, r in results.items():
+        if "error" in r:
+            print(f"{mode:<6} error: {r['error']}")
+            continue
+        print(f"{mode:<6} {r['precision']:<10} {r['load_seconds']:>7} {r['weights_mb']:>11} "
+              f"{r['peak_rss_mb']:>8} {r['tokens_per_second']:>7} {r['perplexity']:>8}")
+    for mode, r in results.items():
+        for reply in r.get("replies", []):
+            print(f"[{mode}] {reply}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
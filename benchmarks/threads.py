@@ -0,0 +1,173 @@
+"""
+Суммарная скорость генерации (токенов/с на машину) для разных сочетаний
+числа процессов с моделью и потоков torch в каждом.
+
+Для каждого сочетания запускается W процессов (как W воркеров gunicorn или
+рабочих сервера инференса) с WEB_CONCURRENCY=W и AI_TORCH_THREADS=T; "auto" —
+число потоков, которое ai_core выводит сам (ядра / процессы). Процессы грузят
+модель, стартуют одновременно и в течение --seconds генерируют ответы
+фиксированной длины. Выводятся суммарные токены/с, токены/с на процесс и
+задержка одной генерации. С --affinity процессы закрепляются за своей долей
+ядер (AI_CPU_AFFINITY=auto).
+
+Запуск из корня репозитория:
+    python benchmarks/threads.py [--workers 1,2,4] [--threads auto,1,2,4] [--seconds 10]
+                                 [--tokens 32] [--affinity] [--json out.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = [
+    "Привет!",
+    "Как дела?",
+    "Расскажи о себе.",
+    "Что ты любишь есть?",
+    "Какая сегодня погода в космосе?",
+]
+
+
+def _run_worker(seconds: float, new_tokens: int) -> None:
+    """Дочерний процесс: грузит модель, ждёт общей команды на старт и генерирует seconds секунд."""
+    sys.path.insert(0, ROOT)
+    import ai_core
+
+    if not ai_core._ensure_loaded():
+        print(json.dumps({"error": "model not available"}), flush=True)
+        return
+    torch, model, tokenizer = ai_core.torch, ai_core._model, ai_core._tokenizer
+    prompts = [ai_core._build_prompt([{"role": "user", "content": p}]) for p in PROMPTS]
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    generated = 0
+    latencies = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        # KV-кеш промпта generate дописывает на месте, поэтому каждый раз берём свежую копию
+        prompt = prompts[len(latencies) % len(prompts)]
+        input_ids, attention_mask, past_key_values = ai_core._encode_batch("reply", [prompt])
+        call_started = time.perf_counter()
+        with torch.no_grad():
+            out = model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        latencies.append(time.perf_counter() - call_started)
+        generated += out.shape[1] - input_ids.shape[1]
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "tokens": int(generated),
+        "seconds": elapsed,
+        "generate_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "intra_op": ai_core._thread_topology.get("intra_op"),
+        "inter_op": ai_core._thread_topology.get("inter_op"),
+        "affinity": ai_core._thread_topology.get("affinity"),
+    }), flush=True)
+
+
+def _run_combination(workers: int, threads: str, args) -> dict:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), AI_CPU_AFFINITY="auto" if args.affinity else "0")
+    env.pop("AI_INFERENCE_SOCKET", None)
+    env.pop("AI_WORKER_INDEX", None)
+    if threads == "auto":
+        env.pop("AI_TORCH_THREADS", None)
+    else:
+        env["AI_TORCH_THREADS"] = threads
+
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             "--seconds", str(args.seconds), "--tokens", str(args.tokens)],
+            env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for _ in range(workers)
+    ]
+    # Старт по общей команде, когда все процессы загрузили модель
+    for proc in procs:
+        for line in proc.stdout:
+            if line.strip() == "ready" or line.startswith("{"):
+                break
+    for proc in procs:
+        proc.stdin.write("go\n")
+        proc.stdin.flush()
+
+    reports = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        lines = [line for line in out.splitlines() if line.startswith("{")]
+        reports.append(json.loads(lines[-1]) if lines else {"error": f"exit code {proc.returncode}"})
+
+    errors = [r["error"] for r in reports if "error" in r]
+    if errors:
+        return {"error": errors[0]}
+    tokens = sum(r["tokens"] for r in reports)
+    wall = max(r["seconds"] for r in reports)
+    return {
+        "workers": workers,
+        "threads": threads,
+        "intra_op": reports[0]["intra_op"],
+        "inter_op": reports[0]["inter_op"],
+        "affinity": [r["affinity"] for r in reports] if args.affinity else None,
+        "tokens_per_second": round(tokens / wall, 1),
+        "tokens_per_second_per_worker": round(tokens / wall / workers, 1),
+        "generate_p50_ms": round(sorted(r["generate_p50_ms"] for r in reports)[workers // 2], 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--threads", default="auto,1,2,4", help="потоков torch на процесс через запятую")
+    parser.add_argument("--seconds", type=float, default=10.0, help="длительность замера")
+    parser.add_argument("--tokens", type=int, default=32, help="токенов в одной генерации")
+    parser.add_argument("--affinity", action="store_true", help="закреплять процессы за ядрами")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _run_worker(args.seconds, args.tokens)
+        return
+
+    print(f"ℹ️ Ядер доступно: {len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()}")
+    results = []
+    for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+        for threads in [t.strip() for t in args.threads.split(",") if t.strip()]:
+            result = _run_combination(workers, threads, args)
+            results.append(result)
+            if "error" in result:
+                print(f"workers={workers} threads={threads} error: {result['error']}")
+                continue
+            print(f"workers={workers:<2} threads={threads:<4} (intra {result['intra_op']}, inter {result['inter_op']}): "
+                  f"{result['tokens_per_second']:>8} ток/с всего, {result['tokens_per_second_per_worker']:>7} на процесс, "
+                  f"generate p50 {result['generate_p50_ms']} мс", flush=True)
+
+    ok = [r for r in results if "error" not in r]
+    if ok:
+        best = max(ok, key=lambda r: r["tokens_per_second"])
+        print(f"\n✅ Лучшее сочетание: процессов {best['workers']} × потоков {best['intra_op']} — "
+              f"{best['tokens_per_second']} ток/с")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
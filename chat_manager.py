@@ -1,22 +1,36 @@
 from __future__ import annotations
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 import os
-import requests
+import threading
 from io import BytesIO
 from PIL import Image, ImageDraw
 import random
-import base64
+import time
 
-from db_manager import get_session, Chat, serialize_history, deserialize_history
-from ai_core import generate_chat_title
+from sqlalchemy import select, insert, func, exists
+from sqlalchemy.exc import IntegrityError
 
+from db_manager import get_session, Chat, Message
+from ai_core import generate_chat_title, get_cat_api_url
+from image_manager import put_image, put_image_with_variants, get_image_data, get_image_variant
 
-def _fetch_cat_image_bytes() -> Optional[bytes]:
-    """Получить изображение кота с aleatori.cat"""
+# Названия чатов генерируются в фоне, чтобы не задерживать первое сообщение
+# и не держать транзакцию БД открытой на время генерации
+_title_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-title")
+
+# Название нового чата, пока фоновая генерация его не заменила
+_DEFAULT_CHAT_TITLE = "Новый чат с Космокотом"
+
+
+def _download_cat_image() -> Optional[bytes]:
+    """Скачать изображение кота с aleatori.cat; None при любой ошибке"""
+    import requests
     try:
         # Получаем JSON с информацией о случайном коте
-        url = "https://aleatori.cat/random.json"
+        url = get_cat_api_url()
         resp = requests.get(url, timeout=5)
         resp.raise_for_status()
         data = resp.json()
@@ -33,11 +47,16 @@ def _fetch_cat_image_bytes() -> Optional[bytes]:
             return img_resp.content
         else:
             print("❌ Полученные данные не являются изображением")
-            return _load_default_avatar()
+            return None
             
     except Exception as e:
         print(f"❌ Ошибка получения кота с aleatori.cat: {e}")
-        return _load_default_avatar()
+        return None
+
+
+def _fetch_cat_image_bytes() -> Optional[bytes]:
+    """Получить изображение кота с aleatori.cat (или default_avatar.png при ошибке)"""
+    return _download_cat_image() or _load_default_avatar()
 
 
 def _load_default_avatar() -> Optional[bytes]:
@@ -60,22 +79,186 @@ def _load_default_avatar() -> Optional[bytes]:
     except Exception as e:
         print(f"Ошибка загрузки default_avatar.png: {e}")
 
-def get_chat_avatar(chat_id: str) -> Optional[bytes]:
-    """Получить аватар чата по его ID"""
+
+def _make_avatar_pair(image_bytes: Optional[bytes]) -> Optional[Tuple[bytes, bytes]]:
+    """Аватар чата 500x500 и иконка 64x64 из исходной картинки"""
+    if not image_bytes:
+        return None
+    circle_bytes = _circle_crop(image_bytes, 500)
+    if not circle_bytes:
+        return None
+    icon_bytes = _circle_crop(circle_bytes, 64)
+    return (circle_bytes, icon_bytes) if icon_bytes else None
+
+
+_default_pair: Optional[Tuple[bytes, bytes]] = None
+
+
+def _default_avatar_pair() -> Optional[Tuple[bytes, bytes]]:
+    """Обработанный default_avatar.png (считается один раз)"""
+    global _default_pair
+    if _default_pair is None:
+        _default_pair = _make_avatar_pair(_load_default_avatar())
+    return _default_pair
+
+
+def _store_avatar_pair(pair: Tuple[bytes, bytes]) -> Tuple[str, str]:
+    """
+    Положить пару в хранилище картинок по хешу содержимого; одинаковые хранятся один раз.
+    Для аватара сразу строятся копии поменьше (WebP/PNG), чтобы не отдавать 500x500 в кружок 50px.
+    Возвращает (хеш аватара, хеш иконки).
+    """
+    circle_bytes, icon_bytes = pair
+    return put_image_with_variants(circle_bytes), put_image(icon_bytes)
+
+
+class AvatarPool:
+    """
+    Пул заранее скачанных, обработанных и сохранённых в хранилище картинок
+    пар (аватар, иконка) для новых чатов — в пуле лежат их хеши.
+
+    create_chat забирает готовую пару мгновенно; когда в пуле остаётся меньше
+    low_water пар, фоновый поток докачивает котов с aleatori.cat до target_size
+    и строит копии аватара поменьше. Поток запускается при первом pop — не в
+    каждом процессе (CLI-командах, воркерах без новых чатов), а там, где чаты создают.
+    """
+
+    def __init__(self, target_size: int = 8, low_water: int = 4) -> None:
+        self.target_size = max(1, target_size)
+        self.low_water = min(max(0, low_water), self.target_size)
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.fetch_failures = 0
+
+    def start(self) -> None:
+        """Запустить фоновое пополнение (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="avatar-pool", daemon=True)
+            self._thread.start()
+        self._refill.set()
+
+    def pop(self) -> Optional[Tuple[str, str]]:
+        """Забрать хеши готовой пары; None, если пул пуст"""
+        self.start()
+        with self._lock:
+            pair = self._items.popleft() if self._items else None
+            if pair is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if len(self._items) < self.low_water:
+                self._refill.set()
+        return pair
+
+    def _loop(self) -> None:
+        failures_in_row = 0
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while True:
+                with self._lock:
+                    if len(self._items) >= self.target_size:
+                        break
+                hashes = self._fetch()
+                if hashes is None:
+                    with self._lock:
+                        self.fetch_failures += 1
+                    failures_in_row += 1
+                    # aleatori.cat недоступен — повторяем с растущей паузой
+                    time.sleep(min(60, 2 ** failures_in_row))
+                    continue
+                failures_in_row = 0
+                with self._lock:
+                    self._items.append(hashes)
+                    self.refilled += 1
+
+    def _fetch(self) -> Optional[Tuple[str, str]]:
+        """Скачать и обработать нового кота и сохранить его картинки; None при ошибке"""
+        pair = _make_avatar_pair(_download_cat_image())
+        if pair is None:
+            return None
+        try:
+            return _store_avatar_pair(pair)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения аватара в пул: {e}")
+            return None
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            requests_total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "size": len(self._items),
+                "target_size": self.target_size,
+                "low_water": self.low_water,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests_total, 3) if requests_total else None,
+                "refilled": self.refilled,
+                "fetch_failures": self.fetch_failures,
+            }
+
+
+_avatar_pool: Optional[AvatarPool] = None
+_avatar_pool_lock = threading.Lock()
+
+
+def _get_avatar_pool() -> Optional[AvatarPool]:
+    """
+    Общий пул аватаров. Размер задаётся AVATAR_POOL_SIZE (0 — пул выключен,
+    кот качается синхронно при создании чата), порог дозаправки — AVATAR_POOL_LOW_WATER.
+    """
+    global _avatar_pool
+    target_size = int(os.environ.get("AVATAR_POOL_SIZE", "8"))
+    if target_size <= 0:
+        return None
+    if _avatar_pool is None:
+        with _avatar_pool_lock:
+            if _avatar_pool is None:
+                low_water = int(os.environ.get("AVATAR_POOL_LOW_WATER", str(max(1, target_size // 2))))
+                _avatar_pool = AvatarPool(target_size, low_water)
+    return _avatar_pool
+
+
+def get_avatar_pool_stats() -> Dict[str, any]:
+    """Статистика пула аватаров для мониторинга"""
+    pool = _get_avatar_pool()
+    if pool is None:
+        return {"enabled": False}
+    return pool.stats()
+
+
+def get_chat_avatar(chat_id: str, size: Optional[int] = None, image_format: str = "png") -> Optional[Tuple[bytes, str]]:
+    """Получить аватар чата по его ID: (данные, mimetype) ближайшего подходящего размера"""
     with get_session() as session:
-        chat = session.query(Chat).filter_by(chat_id=chat_id).first()
-        if chat and chat.cat_avatar_blob:
-            return chat.cat_avatar_blob
+        row = session.query(Chat.avatar_hash, Chat.cat_avatar_blob).filter(Chat.chat_id == chat_id).first()
+    if not row:
         return None
+    avatar = get_image_variant(row[0], size, image_format)
+    if avatar:
+        return avatar
+    # Чаты, ещё не перенесённые в хранилище картинок, держат аватар в строке (только PNG 500x500)
+    return (row[1], "image/png") if row[1] else None
 
 
-def update_chat_avatar(chat_id: str, avatar_blob: bytes) -> None:
-    """Обновить аватар чата"""
+def update_chat_avatar(chat_id: str, avatar_blob: bytes) -> bool:
+    """Обновить аватар чата; False, если такого чата нет (картинка тогда не сохраняется)"""
+    with get_session() as session:
+        if not session.query(exists().where(Chat.chat_id == chat_id)).scalar():
+            return False
+    avatar_hash = put_image_with_variants(avatar_blob)
     with get_session() as session:
-        chat = session.query(Chat).filter_by(chat_id=chat_id).first()
-        if chat:
-            chat.cat_avatar_blob = avatar_blob
-            session.commit()
+        session.query(Chat).filter(Chat.chat_id == chat_id).update(
+            {Chat.avatar_hash: avatar_hash, Chat.cat_avatar_blob: None}, synchronize_session=False
+        )
+    return True
 
 
 def _load_chat(session, chat_id: str) -> Optional[Chat]:
@@ -106,7 +289,7 @@ def _circle_crop(image_bytes: bytes, size: int = 500) -> Optional[bytes]:
             im.putalpha(mask)
             
             out = BytesIO()
-            im.save(out, format="PNG", optimize=True, compress_level=9)
+            im.save(out, format="PNG")
             return out.getvalue()
             
     except Exception as e:
@@ -114,140 +297,167 @@ def _circle_crop(image_bytes: bytes, size: int = 500) -> Optional[bytes]:
         return None
 
 
+def _generate_title_job(chat_id: str, first_message: str) -> None:
+    """Фоновая задача: сгенерировать название и записать его в чат"""
+    try:
+        title = generate_chat_title(first_message)
+        with get_session() as session:
+            chat = _load_chat(session, chat_id)
+            if chat:
+                chat.title = title
+        print(f"✅ Чат {chat_id} переименован в '{title}'")
+    except Exception as e:
+        print(f"❌ Ошибка генерации названия чата {chat_id}: {e}")
+
+
+def schedule_title_generation(chat_id: str, first_message: str) -> None:
+    """Поставить генерацию названия чата в фоновую очередь"""
+    _title_executor.submit(_generate_title_job, chat_id, first_message)
+
+
+def is_title_pending(chat_id: str) -> bool:
+    """
+    Генерируется ли сейчас название чата: в чате уже есть сообщения, а название всё ещё
+    стандартное. Признак берётся из базы, поэтому верен в любом процессе, а не только
+    в том, что поставил генерацию в очередь.
+    """
+    with get_session() as session:
+        title = session.query(Chat.title).filter(Chat.chat_id == chat_id).scalar()
+        if title != _DEFAULT_CHAT_TITLE:
+            return False
+        return bool(session.query(exists().where(Message.chat_id == chat_id)).scalar())
+
+
 def create_chat(user_id: int, first_message: str = None) -> str:
     """Создать новый чат с аватаром кота и сгенерированным названием"""
     chat_id = uuid.uuid4().hex[:16]
     
+    # Берём готового кота из пула (его картинки уже в хранилище вместе с копиями
+    # поменьше); если пул пуст — аватар по умолчанию.
+    # Без пула (AVATAR_POOL_SIZE=0) качаем кота синхронно, как раньше.
+    pool = _get_avatar_pool()
+    hashes = pool.pop() if pool is not None else None
+    if hashes is None:
+        pair = _make_avatar_pair(_fetch_cat_image_bytes()) if pool is None else None
+        if pair is None:
+            pair = _default_avatar_pair()
+        hashes = _store_avatar_pair(pair) if pair else None
+    avatar_hash, icon_hash = hashes if hashes else (None, None)
+    
     with get_session() as session:
-        # Получаем аватар кота
-        cat_bytes = _fetch_cat_image_bytes()
-        circle_bytes = _circle_crop(cat_bytes, 500) if cat_bytes else None
-        
-        if not circle_bytes:
-            default_avatar = _load_default_avatar()
-            circle_bytes = _circle_crop(default_avatar, 500) if default_avatar else None
-        
-        # Создаем иконку (маленький аватар 64x64)
-        icon_bytes = _circle_crop(circle_bytes, 64) if circle_bytes else None
-        
-        # Генерируем название чата
-        if first_message:
-            title = generate_chat_title(first_message)
-        else:
-            title = "Новый чат с Космокотом"
+        # Название по первому сообщению сгенерируется в фоне
+        title = _DEFAULT_CHAT_TITLE
         
         chat = Chat(
             user_id=user_id,
             chat_id=chat_id,
-            chat_history=serialize_history([]),
-            cat_avatar_blob=circle_bytes,
+            avatar_hash=avatar_hash,
             title=title,
-            icon_blob=icon_bytes,
+            icon_hash=icon_hash,
         )
         session.add(chat)
         session.commit()
         
         print(f"✅ Создан чат '{title}' ({chat_id}) для пользователя {user_id}")
-        return chat_id
+
+    if first_message:
+        schedule_title_generation(chat_id, first_message)
+    return chat_id
+
+
+def user_owns_chat(chat_id: str, user_id: int) -> bool:
+    """Проверить, что чат принадлежит пользователю (EXISTS по индексам, без чтения блобов)"""
+    with get_session() as session:
+        return bool(session.query(
+            exists().where(Chat.chat_id == chat_id, Chat.user_id == user_id)
+        ).scalar())
 
 
 def list_chats(user_id: int) -> List[Dict[str, any]]:
-    """Получить список чатов пользователя с иконками и названиями"""
-    result: List[Dict[str, any]] = []
+    """Получить список чатов пользователя: названия и ссылки на иконки, без блобов"""
     with get_session() as session:
         rows = (
-            session.query(Chat)
+            session.query(Chat.chat_id, Chat.title, Chat.icon_hash, Chat.icon_blob.isnot(None))
             .filter(Chat.user_id == user_id)
             .order_by(Chat.id.desc())
             .all()
         )
-        for c in rows:
-            # Конвертируем иконку в base64 для фронтенда
-            icon_base64 = None
-            if c.icon_blob:
-                icon_base64 = base64.b64encode(c.icon_blob).decode('utf-8')
-            
-            result.append({
-                "chat_id": c.chat_id,
-                "title": c.title or "Чат с Космокотом",
-                "icon": icon_base64
-            })
-    return result
+    return [_chat_summary(*row) for row in rows]
 
 
 def get_chat_info(chat_id: str) -> Optional[Dict[str, any]]:
     """Получить информацию о чате (название, иконка)"""
     with get_session() as session:
-        chat = _load_chat(session, chat_id)
-        if not chat:
-            return None
-            
-        icon_base64 = None
-        if chat.icon_blob:
-            icon_base64 = base64.b64encode(chat.icon_blob).decode('utf-8')
-            
-        return {
-            "chat_id": chat.chat_id,
-            "title": chat.title or "Чат с Космокотом",
-            "icon": icon_base64
-        }
+        row = (
+            session.query(Chat.chat_id, Chat.title, Chat.icon_hash, Chat.icon_blob.isnot(None))
+            .filter(Chat.chat_id == chat_id)
+            .first()
+        )
+    return _chat_summary(*row) if row else None
+
 
+def _chat_summary(chat_id: str, title: Optional[str], icon_hash: Optional[str], has_icon_blob: bool) -> Dict[str, any]:
+    return {
+        "chat_id": chat_id,
+        "title": title or "Чат с Космокотом",
+        "icon_hash": icon_hash,
+        "has_icon": bool(icon_hash or has_icon_blob),
+    }
 
-def get_chat_history(chat_id: str) -> List[Dict]:
-    """Получить историю сообщений чата"""
+
+def get_chat_icon(chat_id: str) -> Optional[bytes]:
+    """Получить иконку чата (64x64) — без чтения остальных колонок"""
     with get_session() as session:
-        chat = _load_chat(session, chat_id)
-        if not chat:
-            return []
-    return deserialize_history(chat.chat_history)
+        row = session.query(Chat.icon_hash, Chat.icon_blob).filter(Chat.chat_id == chat_id).first()
+    if not row:
+        return None
+    return get_image_data(row[0]) or row[1]
 
 
-def append_message(chat_id: str, role: str, content: str) -> None:
-    """Добавить сообщение в историю чата"""
+def get_chat_history(chat_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Получить историю сообщений чата (или только последние limit сообщений)"""
     with get_session() as session:
-        chat = _load_chat(session, chat_id)
-        if not chat:
-            return
-            
-        history = deserialize_history(chat.chat_history)
-        
-        # Если это первое сообщение пользователя, генерируем название чата
-        if role == 'user' and len(history) == 0:
-            title = generate_chat_title(content)
-            chat.title = title
-        
-        history.append({"role": role, "content": content})
-
-        def _prune_history(hist: List[Dict]) -> List[Dict]:
-            """Ограничить историю последними 5 парами сообщений пользователь-ассистент"""
-            picked_rev = []
-            user_count = 0
-            assistant_count = 0
-            for m in reversed(hist):
-                r = m.get("role", "user")
-                if r == "user" and user_count < 5:
-                    picked_rev.append(m)
-                    user_count += 1
-                elif r == "assistant" and assistant_count < 5:
-                    picked_rev.append(m)
-                    assistant_count += 1
-                if user_count >= 5 and assistant_count >= 5:
-                    break
-            return list(reversed(picked_rev))
-
-        pruned = _prune_history(history)
-        chat.chat_history = serialize_history(pruned)
-        session.commit()
+        query = (
+            session.query(Message.role, Message.content)
+            .filter(Message.chat_id == chat_id)
+            .order_by(Message.seq.desc())
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        rows = query.all()
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+
+def append_message(chat_id: str, role: str, content: str) -> None:
+    """Добавить сообщение в историю чата (один INSERT со следующим номером)"""
+    for attempt in range(3):
+        next_seq = (
+            select(func.coalesce(func.max(Message.seq), 0) + 1)
+            .where(Message.chat_id == chat_id)
+            .scalar_subquery()
+        )
+        try:
+            with get_session() as session:
+                seq = session.execute(
+                    insert(Message)
+                    .values(chat_id=chat_id, seq=next_seq, role=role, content=content)
+                    .returning(Message.seq)
+                ).scalar_one()
+            break
+        except IntegrityError:
+            # Параллельная запись в тот же чат заняла этот номер — пробуем следующий
+            if attempt == 2:
+                raise
+
+    # Если это первое сообщение пользователя, название чата сгенерируем в фоне
+    if role == 'user' and seq == 1:
+        schedule_title_generation(chat_id, content)
 
 
 def clear_history(chat_id: str) -> None:
     """Очистить историю сообщений чата"""
     with get_session() as session:
-        chat = _load_chat(session, chat_id)
-        if not chat:
-            return
-        chat.chat_history = serialize_history([])
-        session.commit()
+        session.query(Message).filter(Message.chat_id == chat_id).delete(synchronize_session=False)
 
 
 def process_avatar(image_bytes: bytes, size: int = 500) -> Optional[bytes]:
@@ -1,9 +1,11 @@
 from __future__ import annotations
 from typing import Optional, Iterator, List, Dict, Any
 from contextlib import contextmanager
+from datetime import datetime, timezone
 import os
 import json
-from sqlalchemy import create_engine, String, Integer, LargeBinary, ForeignKey
+from sqlalchemy import create_engine, event, String, Integer, LargeBinary, Text, DateTime, ForeignKey, Index, update, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, Session
 
 class Base(DeclarativeBase):
@@ -15,12 +17,76 @@ SessionLocal: sessionmaker[Session] | None = None
 def get_database_url() -> str:
     return os.environ.get("DATABASE_URL", "sqlite:///cosmocats.db")
 
+def get_db_profile() -> str:
+    """DB_PROFILE: "default" — движок без настроек, "production" — WAL, прагмы и пул для многопоточного сервера."""
+    return os.environ.get("DB_PROFILE", "default")
+
+def _get_engine_options() -> Dict[str, Any]:
+    """Дополнительные параметры create_engine из DB_ENGINE_OPTIONS (JSON), например для Postgres."""
+    raw = os.environ.get("DB_ENGINE_OPTIONS", "")
+    return json.loads(raw) if raw else {}
+
+def _is_file_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+def _get_sqlite_busy_timeout_ms() -> int:
+    return int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _production_engine_options(url: str) -> Dict[str, Any]:
+    """Пул под потоковый сервер: соединения переиспользуются, мёртвые отсеиваются перед выдачей."""
+    options: Dict[str, Any] = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": True,
+    }
+    if make_url(url).get_backend_name() == "sqlite":
+        if not _is_file_sqlite(url):
+            # Память SQLite живёт в одном соединении — пул для неё не настраиваем
+            return {}
+        # Соединение берётся из пула разными потоками; ждать блокировку будет busy_timeout
+        options["connect_args"] = {"check_same_thread": False, "timeout": _get_sqlite_busy_timeout_ms() / 1000}
+    return options
+
+def _install_sqlite_pragmas(engine) -> None:
+    """
+    На каждое новое соединение: WAL (читатели не ждут писателя), synchronous=NORMAL
+    (в WAL безопасно при сбое процесса), кеш страниц и mmap, ожидание блокировки вместо ошибки.
+    """
+    cache_kb = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+    mmap_bytes = int(os.environ.get("SQLITE_MMAP_SIZE_MB", "256")) * 1024 * 1024
+    busy_timeout_ms = _get_sqlite_busy_timeout_ms()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{cache_kb}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_bytes}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
 def init_db(database_url: Optional[str] = None) -> None:
     global _engine, SessionLocal
     url = database_url or get_database_url()
-    _engine = create_engine(url, future=True)
+    profile = get_db_profile()
+    options: Dict[str, Any] = {}
+    if profile == "production":
+        options.update(_production_engine_options(url))
+    options.update(_get_engine_options())
+    if _engine is not None:
+        _engine.dispose()
+    _engine = create_engine(url, future=True, **options)
+    if profile == "production" and _is_file_sqlite(url):
+        _install_sqlite_pragmas(_engine)
+    print(f"ℹ️ База данных: {_engine.url.render_as_string(hide_password=True)} (профиль {profile})")
     SessionLocal = sessionmaker(bind=_engine, autoflush=False, expire_on_commit=False, future=True)
     Base.metadata.create_all(_engine)
+    _add_missing_columns()
+    _migrate_history_blobs()
 
 @contextmanager
 def get_session() -> Iterator[Session]:
@@ -43,7 +109,9 @@ class User(Base):
     login: Mapped[str] = mapped_column(String(255), unique=True, nullable=False, index=True)
     password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
     name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Устаревшее хранение картинки в строке; новые пишутся в images, здесь только хеш
     avatar_blob: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    avatar_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     chats: Mapped[List["Chat"]] = relationship(back_populates="user", cascade="all, delete-orphan")
 
 class Chat(Base):
@@ -51,12 +119,42 @@ class Chat(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), index=True, nullable=False)
     chat_id: Mapped[str] = mapped_column(String(64), unique=True, nullable=False, index=True)
+    # Устаревшее хранение истории одним JSON-блобом; при init_db переносится в messages
     chat_history: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    # Устаревшее хранение картинок в строке; новые пишутся в images, здесь только хеши
     cat_avatar_blob: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
     title: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     icon_blob: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    avatar_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    icon_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     user: Mapped[User] = relationship(back_populates="chats")
 
+class Message(Base):
+    __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_chat_id_seq", "chat_id", "seq", unique=True),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[str] = mapped_column(String(64), ForeignKey("chats.chat_id"), nullable=False)
+    seq: Mapped[int] = mapped_column(Integer, nullable=False)
+    role: Mapped[str] = mapped_column(String(16), nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class StoredImage(Base):
+    """Картинка, адресуемая SHA-256 своего содержимого: каждая уникальная хранится один раз."""
+    __tablename__ = "images"
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    mimetype: Mapped[str] = mapped_column(String(64), nullable=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class ImageVariant(Base):
+    """Уменьшенная копия картинки из images в заданном размере и формате (сама копия тоже лежит в images)."""
+    __tablename__ = "image_variants"
+    source_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer, primary_key=True)
+    format: Mapped[str] = mapped_column(String(8), primary_key=True)
+    variant_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
 def serialize_history(messages: List[Dict[str, Any]]) -> bytes:
     return json.dumps(messages, ensure_ascii=False).encode("utf-8")
 
@@ -66,4 +164,41 @@ def deserialize_history(blob: Optional[bytes]) -> List[Dict[str, Any]]:
     try:
         return json.loads(blob.decode("utf-8"))
     except (json.JSONDecodeError, UnicodeDecodeError):
-        return []
\ No newline at end of file
+        return []
+
+def _add_missing_columns() -> None:
+    """create_all не меняет существующие таблицы — добавляем новые nullable-колонки через ALTER TABLE."""
+    inspector = inspect(_engine)
+    with _engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=_engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"✅ Добавлена колонка {table.name}.{column.name}")
+
+def _migrate_history_blobs() -> None:
+    """Переносит историю из JSON-блобов chats.chat_history в таблицу messages."""
+    with get_session() as session:
+        rows = (
+            session.query(Chat.id, Chat.chat_id, Chat.chat_history)
+            .filter(Chat.chat_history.isnot(None))
+            .all()
+        )
+        for row_id, chat_id, blob in rows:
+            already_migrated = session.query(Message.id).filter(Message.chat_id == chat_id).first() is not None
+            if not already_migrated:
+                for seq, message in enumerate(deserialize_history(blob), start=1):
+                    session.add(Message(
+                        chat_id=chat_id,
+                        seq=seq,
+                        role=message.get("role", "user"),
+                        content=message.get("content", ""),
+                    ))
+            session.execute(update(Chat).where(Chat.id == row_id).values(chat_history=None))
+        if rows:
+            print(f"✅ История {len(rows)} чатов перенесена в таблицу messages")
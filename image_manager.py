@@ -0,0 +1,157 @@
+from __future__ import annotations
+from typing import Optional, Tuple, Dict
+from io import BytesIO
+import hashlib
+from PIL import Image
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+import db_manager
+
+BACKFILL_BATCH_SIZE = 100
+VARIANT_SIZES = (64, 128, 256, 1024)
+VARIANT_FORMATS = {"webp": "image/webp", "png": "image/png"}
+WEBP_QUALITY = 85
+
+def image_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def put_image(data: bytes, mimetype: str = "image/png") -> str:
+    """Сохраняет картинку (если такой ещё нет) и возвращает её хеш."""
+    digest = image_hash(data)
+    try:
+        with db_manager.get_session() as session:
+            stored = session.query(exists().where(db_manager.StoredImage.hash == digest)).scalar()
+            if not stored:
+                session.add(db_manager.StoredImage(hash=digest, mimetype=mimetype, data=data))
+    except IntegrityError:
+        # Ту же картинку параллельно сохранил другой поток — это нормально
+        pass
+    return digest
+
+def get_image(digest: str) -> Optional[Tuple[bytes, str]]:
+    """Возвращает (данные, mimetype) по хешу."""
+    with db_manager.get_session() as session:
+        row = (
+            session.query(db_manager.StoredImage.data, db_manager.StoredImage.mimetype)
+            .filter(db_manager.StoredImage.hash == digest)
+            .first()
+        )
+        return (row[0], row[1]) if row else None
+
+def get_image_data(digest: Optional[str]) -> Optional[bytes]:
+    if not digest:
+        return None
+    image = get_image(digest)
+    return image[0] if image else None
+
+def _load_variants(digest: str) -> Dict[Tuple[int, str], str]:
+    with db_manager.get_session() as session:
+        rows = (
+            session.query(db_manager.ImageVariant.size, db_manager.ImageVariant.format, db_manager.ImageVariant.variant_hash)
+            .filter(db_manager.ImageVariant.source_hash == digest)
+            .all()
+        )
+    return {(size, image_format): variant_hash for size, image_format, variant_hash in rows}
+
+def _encode_variant(im: Image.Image, size: int, image_format: str) -> bytes:
+    if im.size != (size, size):
+        im = im.resize((size, size), Image.LANCZOS)
+    out = BytesIO()
+    if image_format == "webp":
+        im.save(out, format="WEBP", quality=WEBP_QUALITY)
+    else:
+        im.save(out, format="PNG")
+    return out.getvalue()
+
+def ensure_variants(digest: str, data: Optional[bytes] = None) -> Dict[Tuple[int, str], str]:
+    """
+    Строит (если ещё нет) уменьшенные копии квадратной картинки во всех форматах VARIANT_FORMATS.
+    Размеры — из VARIANT_SIZES меньше исходного плюс сам исходный; больше исходного не растягиваем.
+    Возвращает {(размер, формат): хеш копии}.
+    """
+    variants = _load_variants(digest)
+    if variants:
+        return variants
+    stored = get_image(digest) if data is None else (data, None)
+    if not stored:
+        return {}
+    try:
+        with Image.open(BytesIO(stored[0])) as im:
+            source_format = (im.format or "").lower()
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+    except Exception as e:
+        print(f"❌ Ошибка при построении копий картинки {digest[:12]}: {e}")
+        return {}
+    source_size = min(im.size)
+    sizes = sorted({size for size in VARIANT_SIZES if size < source_size} | {source_size})
+    for size in sizes:
+        for image_format, mimetype in VARIANT_FORMATS.items():
+            if size == source_size and image_format == source_format:
+                variants[(size, image_format)] = digest
+            else:
+                variants[(size, image_format)] = put_image(_encode_variant(im, size, image_format), mimetype)
+    try:
+        with db_manager.get_session() as session:
+            session.add_all([
+                db_manager.ImageVariant(source_hash=digest, size=size, format=image_format, variant_hash=variant_hash)
+                for (size, image_format), variant_hash in variants.items()
+            ])
+    except IntegrityError:
+        # Копии параллельно построил другой поток — содержимое у них то же самое
+        pass
+    return variants
+
+def put_image_with_variants(data: bytes, mimetype: str = "image/png") -> str:
+    """put_image и сразу построение уменьшенных копий (при загрузке, а не при первом показе)."""
+    digest = put_image(data, mimetype)
+    ensure_variants(digest, data)
+    return digest
+
+def get_image_variant(digest: Optional[str], size: Optional[int] = None, image_format: str = "png") -> Optional[Tuple[bytes, str]]:
+    """
+    Копия картинки не меньше size в формате image_format (или самая большая, если такой нет).
+    Без size — исходная картинка.
+    """
+    if not digest:
+        return None
+    if size is None:
+        return get_image(digest)
+    variants = ensure_variants(digest)
+    sizes = sorted(variant_size for variant_size, variant_format in variants if variant_format == image_format)
+    if not sizes:
+        return get_image(digest)
+    chosen = next((variant_size for variant_size in sizes if variant_size >= size), sizes[-1])
+    return get_image(variants[(chosen, image_format)])
+
+def _backfill_column(model, blob_column, hash_column) -> int:
+    """Переносит картинки из blob_column в хранилище пачками, проставляя hash_column."""
+    moved = 0
+    while True:
+        with db_manager.get_session() as session:
+            rows = (
+                session.query(model.id, blob_column)
+                .filter(blob_column.isnot(None), hash_column.is_(None))
+                .order_by(model.id)
+                .limit(BACKFILL_BATCH_SIZE)
+                .all()
+            )
+        if not rows:
+            return moved
+        for row_id, blob in rows:
+            digest = put_image(blob)
+            with db_manager.get_session() as session:
+                session.query(model).filter(model.id == row_id).update(
+                    {hash_column: digest, blob_column: None}, synchronize_session=False
+                )
+            moved += 1
+
+def backfill_images() -> dict:
+    """Переносит аватары и иконки из строк users/chats в хранилище images."""
+    result = {
+        "chat_avatars": _backfill_column(db_manager.Chat, db_manager.Chat.cat_avatar_blob, db_manager.Chat.avatar_hash),
+        "chat_icons": _backfill_column(db_manager.Chat, db_manager.Chat.icon_blob, db_manager.Chat.icon_hash),
+        "user_avatars": _backfill_column(db_manager.User, db_manager.User.avatar_blob, db_manager.User.avatar_hash),
+    }
+    with db_manager.get_session() as session:
+        result["unique_images"] = session.query(db_manager.StoredImage.hash).count()
+    return result
@@ -0,0 +1,209 @@
+"""
+Отдельный процесс инференса: владеет моделью и обслуживает генерацию
+ответов и названий чатов по Unix-сокету.
+
+Веб-процессы (gunicorn × N) тогда не держат свою копию весов: ai_core
+ходит сюда, если задана переменная AI_INFERENCE_SOCKET.
+
+Протокол: каждое сообщение — 4 байта длины (big-endian) и JSON в UTF-8.
+Запрос — {"op": ..., ...}:
+    {"op": "ping"}                              -> {"ok": true, "ready": ..., ...}
+    {"op": "reply", "messages": [...]}          -> {"ok": true, "text": "..."}
+    {"op": "title", "first_message": "..."}     -> {"ok": true, "text": "..."}
+    {"op": "stream", "messages": [...]}         -> {"delta": "..."} ... {"reply": "..."}
+Ошибка — {"ok": false, "error": "..."}. По одному соединению можно слать
+несколько запросов подряд.
+
+Запуск:
+    python inference_server.py [--socket /tmp/cosmocats-ai.sock] [--workers 1]
+
+Каждый рабочий процесс грузит свою модель и обслуживает соединения в потоках,
+так что при AI_BATCHING=1 запросы разных веб-процессов собираются в общие пачки.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_SOCKET_PATH = "/tmp/cosmocats-ai.sock"
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+_HEADER = struct.Struct(">I")
+
+
+def send_message(sock: socket.socket, payload: Dict[str, Any]) -> None:
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Читает одно сообщение; None — если собеседник закрыл соединение."""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"слишком большое сообщение: {length} байт")
+    data = _recv_exactly(sock, length)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _handle_request(conn: socket.socket, request: Dict[str, Any]) -> None:
+    import ai_core
+
+    op = request.get("op")
+    if op == "ping":
+        send_message(conn, {"ok": True, "pid": os.getpid(), **ai_core.get_readiness()})
+    elif op == "reply":
+        send_message(conn, {"ok": True, "text": ai_core._local_generate_reply(request.get("messages") or [])})
+    elif op == "title":
+        send_message(conn, {"ok": True, "text": ai_core._local_generate_chat_title(request.get("first_message") or "")})
+    elif op == "stream":
+        events = ai_core._local_stream_reply(request.get("messages") or [])
+        try:
+            for event in events:
+                send_message(conn, event)
+        finally:
+            # Клиент ушёл — закрытие генератора останавливает генерацию
+            events.close()
+    else:
+        send_message(conn, {"ok": False, "error": f"неизвестная операция: {op}"})
+
+
+def _serve_connection(conn: socket.socket) -> None:
+    with conn:
+        try:
+            while True:
+                request = recv_message(conn)
+                if request is None:
+                    return
+                _handle_request(conn, request)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"❌ Ошибка обработки запроса инференса: {e}")
+            try:
+                send_message(conn, {"ok": False, "error": str(e)})
+            except OSError:
+                pass
+
+
+def _worker_loop(listener: socket.socket, warmup_rounds: int) -> None:
+    """Рабочий процесс: грузит модель и принимает соединения, каждое — в своём потоке."""
+    import ai_core
+
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    # Сам сервер генерирует локально, а не ходит клиентом в свой же сокет
+    os.environ.pop("AI_INFERENCE_SOCKET", None)
+    ai_core.start_warmup(warmup_rounds)
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=_serve_connection, args=(conn,), name="inference-conn", daemon=True).start()
+
+
+def _bind(path: str) -> socket.socket:
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o660)
+    listener.listen(128)
+    return listener
+
+
+def _spawn(listener: socket.socket, warmup_rounds: int, index: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Номер рабочего — по нему ai_core выбирает свою долю ядер (AI_CPU_AFFINITY=auto)
+        os.environ["AI_WORKER_INDEX"] = str(index)
+        try:
+            _worker_loop(listener, warmup_rounds)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def serve(path: str, workers: int = 1, warmup_rounds: int = 2) -> None:
+    """
+    Предварительно форкнутый пул: родитель создаёт сокет и следит за рабочими
+    процессами (упавший перезапускается), рабочие делят один accept.
+    Модель грузится в каждом рабочем отдельно — torch небезопасно форкать после инференса.
+    """
+    listener = _bind(path)
+    workers = max(1, workers)
+    # Рабочие делят ядра машины: ai_core делит потоки torch на это число
+    os.environ["AI_INFERENCE_WORKERS"] = str(workers)
+    children: List[int] = [_spawn(listener, warmup_rounds, index) for index in range(workers)]
+    print(f"✅ Сервер инференса слушает {path}, рабочих процессов: {len(children)}")
+
+    stopping = False
+
+    def _stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in children:
+                print(f"⚠️ Рабочий процесс инференса {pid} завершился ({status}), перезапускаю")
+                index = children.index(pid)
+                children[index] = _spawn(listener, warmup_rounds, index)
+            time.sleep(0.5)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        print("ℹ️ Сервер инференса остановлен")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get("AI_INFERENCE_SOCKET") or DEFAULT_SOCKET_PATH,
+                        help="путь к Unix-сокету")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("AI_INFERENCE_WORKERS", "1")),
+                        help="сколько процессов с моделью запустить")
+    parser.add_argument("--warmup-rounds", type=int, default=int(os.environ.get("AI_WARMUP_ROUNDS", "2")),
+                        help="холостых генераций при старте каждого процесса")
+    args = parser.parse_args()
+    serve(args.socket, args.workers, args.warmup_rounds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
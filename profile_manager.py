@@ -1,9 +1,11 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, Tuple
 from io import BytesIO
 from PIL import Image
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash
 import db_manager
+import image_manager
+import auth_manager
 
 AVATAR_SIZE = 1024
 MAX_FILE_SIZE = 5 * 1024 * 1024
@@ -18,7 +20,8 @@ def update_name(user_id: int, new_name: str) -> bool:
         if user is None:
             return False
         user.name = new_name
-        return True
+    auth_manager.invalidate_user(user_id)
+    return True
 
 def change_password(user_id: int, old_password: str, new_password: str) -> bool:
     if not old_password or not new_password:
@@ -29,8 +32,9 @@ def change_password(user_id: int, old_password: str, new_password: str) -> bool:
             return False
         if not check_password_hash(user.password_hash, old_password):
             return False
-        user.password_hash = generate_password_hash(new_password)
-        return True
+        user.password_hash = auth_manager.hash_password(new_password)
+    auth_manager.invalidate_user(user_id)
+    return True
 
 def _prepare_avatar_1024(image_bytes: bytes) -> Optional[bytes]:
     if len(image_bytes) > MAX_FILE_SIZE:
@@ -59,16 +63,25 @@ def upload_avatar(user_id: int, image_bytes: bytes) -> bool:
     prepared = _prepare_avatar_1024(image_bytes)
     if not prepared:
         return False
+    avatar_hash = image_manager.put_image_with_variants(prepared)
     with db_manager.get_session() as session:
-        user = session.get(db_manager.User, user_id)
-        if user is None:
-            return False
-        user.avatar_blob = prepared
-        return True
+        updated = session.query(db_manager.User).filter(db_manager.User.id == user_id).update(
+            {db_manager.User.avatar_hash: avatar_hash, db_manager.User.avatar_blob: None},
+            synchronize_session=False,
+        )
+        return updated > 0
 
-def get_user_avatar(user_id: int) -> Optional[bytes]:
+def get_user_avatar(user_id: int, size: Optional[int] = None, image_format: str = "png") -> Optional[Tuple[bytes, str]]:
     with db_manager.get_session() as session:
-        user = session.get(db_manager.User, user_id)
-        if user is None or not user.avatar_blob:
-            return None
-        return user.avatar_blob
\ No newline at end of file
+        row = (
+            session.query(db_manager.User.avatar_hash, db_manager.User.avatar_blob)
+            .filter(db_manager.User.id == user_id)
+            .first()
+        )
+    if row is None:
+        return None
+    avatar = image_manager.get_image_variant(row[0], size, image_format)
+    if avatar:
+        return avatar
+    # Пользователи, ещё не перенесённые в хранилище картинок, держат аватар в строке (только PNG 1024x1024)
+    return (row[1], "image/png") if row[1] else None
\ No newline at end of file
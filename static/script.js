@@ -120,7 +120,7 @@ class UserMenuManager {
     loadUserAvatar() {
         const userAvatar = document.getElementById('user-avatar-img');
         if (userAvatar && window.current_user_id) {
-            userAvatar.src = `/user/${window.current_user_id}/avatar?t=${Date.now()}`;
+            userAvatar.src = `/user/${window.current_user_id}/avatar?size=64`;
             userAvatar.onload = () => {
                 userAvatar.style.display = 'block';
                 userAvatar.nextElementSibling.style.display = 'none';